@@ -0,0 +1,142 @@
+#!env/bin/python
+
+"""
+Benchmark of SMTP ingest (load generator -> server -> Router -> storage), of /inbox/ reads and /search queries.
+Results are printed and optionally written as JSON, which can be compared with baseline of earlier run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'SmtpTestServer', 'dummy'))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scenario', action='append', help='scenario to run, repeatable, all by default')
+    parser.add_argument('--messages', type=int, default=2000, help='messages sent in each scenario')
+    parser.add_argument('--concurrency', type=int, help='connections, overrides scenario default')
+    parser.add_argument('--reuse', type=int, help='messages per connection, overrides scenario default')
+    parser.add_argument('--storage', choices=('memory', 'database'), default='memory')
+    parser.add_argument('--db', help='path of database file, temporary file by default')
+    parser.add_argument('--inbox-requests', type=int, default=500, help='/inbox/ reads after each scenario, 0 skips')
+    parser.add_argument('--search-requests', type=int, default=100, help='/search queries after each scenario, '
+                        '0 skips')
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--port', type=int, default=2526, help='port of in process server')
+    parser.add_argument('--no-extensions', dest='extensions', action='store_false',
+                        help='send every command separately and messages with DATA')
+    parser.add_argument('--target', help='host:port of already running server, only ingest is measured')
+    parser.add_argument('--output', help='JSON file results are written to')
+    parser.add_argument('--compare', help='JSON results of baseline run')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative change reported as regression')
+    return parser.parse_args(argv)
+
+
+def configure(args):
+    """Set environment of settings, has to be called before any module of server is imported."""
+    os.environ['SMTP_TEST_SERVER_STORAGE'] = args.storage
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['SMTP_TEST_SERVER_DB'] = 'sqlite:///' + path
+    if args.storage == 'database':
+        from settings import engine
+        from mail_srv.migrations import create_schema
+        create_schema(engine)
+
+
+def scenario_options(args, scenarios):
+    names = args.scenario or list(scenarios)
+    unknown = [name for name in names if name not in scenarios]
+    if unknown:
+        raise SystemExit('Unknown scenario %s, available: %s' % (', '.join(unknown), ', '.join(scenarios)))
+    for name in names:
+        if args.concurrency is not None:
+            scenarios[name]['concurrency'] = args.concurrency
+        if args.reuse is not None:
+            scenarios[name]['reuse'] = args.reuse
+    return names
+
+
+def run_target(args, name):
+    from bench.loadgen import MessageFactory, run_load
+    from bench.scenarios import SCENARIOS, memory_usage
+    options = SCENARIOS[name]
+    host, port = args.target.rsplit(':', 1)
+    factory = MessageFactory(options['size_mix'], options['fan_out'])
+    result = asyncio.run(run_load(host, int(port), args.messages, options['concurrency'], options['reuse'], factory,
+                                  extensions=args.extensions))
+    result.update(memory_usage())
+    return {'ingest': result}
+
+
+def run_local(args, name):
+    from bench.scenarios import run_ingest, run_inbox, run_search
+    result = {'ingest': run_ingest(name, args.messages, args.storage, port=args.port,
+                                   extensions=args.extensions)}
+    if args.inbox_requests:
+        result['inbox'] = run_inbox(args.inbox_requests, args.page_size)
+    if args.search_requests:
+        result['search'] = run_search(args.search_requests, page_size=args.page_size)
+    return result
+
+
+def report(name, result):
+    ingest = result['ingest']
+    print('%-10s ingest %8.1f msg/s  p50 %7.2f ms  p99 %7.2f ms  errors %s  stored %s  rss %.1f MiB (peak %.1f)'
+          % (name, ingest['messages_per_second'], ingest['latency_p50'] * 1000, ingest['latency_p99'] * 1000,
+             sum(ingest['errors'].values()), ingest.get('stored', '-'), ingest['rss_mb'], ingest['peak_rss_mb']))
+    inbox = result.get('inbox')
+    if inbox:
+        print('%-10s inbox  %8.1f req/s  p50 %7.2f ms  p99 %7.2f ms'
+              % ('', inbox['requests_per_second'], inbox['latency_p50'] * 1000, inbox['latency_p99'] * 1000))
+    search = result.get('search')
+    if search:
+        print('%-10s search %8.1f req/s  p50 %7.2f ms  p99 %7.2f ms  matched %d of page %d'
+              % ('', search['requests_per_second'], search['latency_p50'] * 1000, search['latency_p99'] * 1000,
+                 search['matched'], search['page_size']))
+    sys.stdout.flush()
+
+
+def report_comparison(rows):
+    print('compared with baseline')
+    for section, key, previous, current, change, regression in rows:
+        print('  %-18s %-20s %12.4f -> %12.4f  %+7.1f %%%s'
+              % (section, key, previous, current, change * 100, '  REGRESSION' if regression else ''))
+
+
+def main(argv):
+    args = parse_args(argv)
+    configure(args)
+    from bench.scenarios import SCENARIOS, compare
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'storage': 'external' if args.target else args.storage,
+        'messages': args.messages,
+        'scenarios': {},
+    }
+    for name in scenario_options(args, SCENARIOS):
+        result = run_target(args, name) if args.target else run_local(args, name)
+        results['scenarios'][name] = result
+        report(name, result)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline:
+            rows = compare(results, json.load(baseline), args.tolerance)
+        report_comparison(rows)
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
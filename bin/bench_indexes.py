@@ -0,0 +1,109 @@
+#!env/bin/python
+
+"""
+Benchmark of hot inbox queries before and after schema migration, on seeded SQLite database.
+Prints query plans and timings of each query for baseline schema and for migrated one.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'SmtpTestServer', 'dummy'))
+
+# schema of mail_srv.models before versioned migrations
+BASELINE_SCHEMA = (
+    'CREATE TABLE mailboxes (id INTEGER NOT NULL PRIMARY KEY, name VARCHAR(191) NOT NULL, description VARCHAR)',
+    'CREATE TABLE message (id INTEGER NOT NULL PRIMARY KEY, mailbox_id INTEGER REFERENCES mailboxes (id), '
+    'sender VARCHAR, recipients VARCHAR, subject VARCHAR(191), source BLOB, size INTEGER, date_created DATETIME)',
+    'CREATE TABLE message_part (id INTEGER NOT NULL PRIMARY KEY, message_id INTEGER NOT NULL, cid VARCHAR, '
+    'part_type VARCHAR, is_attachement INTEGER, file_name VARCHAR, charset VARCHAR(8), body BLOB, size INTEGER, '
+    'created_at DATETIME)',
+)
+
+QUERIES = (
+    ('parts of message',
+     'SELECT id, part_type, size FROM message_part WHERE message_id = :message_id'),
+    ('mailbox listing',
+     'SELECT id, sender, subject, date_created FROM message WHERE mailbox_id = :mailbox_id '
+     'ORDER BY date_created DESC, id DESC LIMIT 50'),
+    ('sender listing',
+     'SELECT id, sender, subject, date_created FROM message WHERE sender = :sender '
+     'ORDER BY date_created DESC, id DESC LIMIT 50'),
+    ('inbox listing',
+     'SELECT id, sender, subject, date_created FROM message ORDER BY date_created DESC, id DESC LIMIT 50'),
+)
+
+
+def seed(connection, messages, mailboxes, parts, batch=10000):
+    start = datetime(2016, 1, 1)
+    connection.exec_driver_sql('INSERT INTO mailboxes (id, name) VALUES ' +
+                               ', '.join('(%d, \'box%d\')' % (idx, idx) for idx in range(1, mailboxes + 1)))
+    part_id = 1
+    for offset in range(0, messages, batch):
+        message_rows, part_rows = [], []
+        for message_id in range(offset + 1, min(offset + batch, messages) + 1):
+            message_rows.append((message_id, random.randint(1, mailboxes), 'sender%d@example.com' % (message_id % 5000),
+                                 'subject %d' % message_id, 100, str(start + timedelta(seconds=message_id))))
+            for _ in range(parts):
+                part_rows.append((part_id, message_id, 'text/plain', 10))
+                part_id += 1
+        connection.exec_driver_sql('INSERT INTO message (id, mailbox_id, sender, subject, size, date_created) '
+                                   'VALUES (?, ?, ?, ?, ?, ?)', message_rows)
+        connection.exec_driver_sql('INSERT INTO message_part (id, message_id, part_type, size) '
+                                   'VALUES (?, ?, ?, ?)', part_rows)
+
+
+def run_queries(engine, params, repeat):
+    from sqlalchemy import text
+    results = []
+    with engine.connect() as connection:
+        connection.exec_driver_sql('ANALYZE')
+        for name, sql in QUERIES:
+            plan = [row[-1] for row in connection.execute(text('EXPLAIN QUERY PLAN ' + sql), params)]
+            started = time.time()
+            for _ in range(repeat):
+                connection.execute(text(sql), params).fetchall()
+            results.append((name, (time.time() - started) / repeat * 1000, plan))
+    return results
+
+
+def report(title, results):
+    print(title)
+    for name, elapsed, plan in results:
+        print('  %-18s %10.3f ms   %s' % (name, elapsed, '; '.join(plan)))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--mailboxes', type=int, default=100)
+    parser.add_argument('--parts', type=int, default=3, help='parts per message')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--db', help='path of database file, temporary file by default')
+    args = parser.parse_args(argv)
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['SMTP_TEST_SERVER_DB'] = 'sqlite:///' + path
+
+    from settings import engine
+    from mail_srv.migrations import migrate
+
+    with engine.begin() as connection:
+        for statement in BASELINE_SCHEMA:
+            connection.exec_driver_sql(statement)
+        seed(connection, args.messages, args.mailboxes, args.parts)
+    params = {'message_id': args.messages // 2, 'mailbox_id': 1, 'sender': 'sender42@example.com'}
+
+    report('baseline schema (%d messages)' % args.messages, run_queries(engine, params, args.repeat))
+    started = time.time()
+    applied = migrate(engine)
+    print('migrations %s applied in %.1f s' % (applied, time.time() - started))
+    report('migrated schema', run_queries(engine, params, args.repeat))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
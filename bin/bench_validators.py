@@ -0,0 +1,51 @@
+#!env/bin/python
+
+"""
+Microbenchmark of property validation, constraint loop of Property.is_valid against validator
+generated by Property.compile_validator. Checks both agree on every sample value.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'SmtpTestServer', 'dummy'))
+
+from api.models import SimpleProperty
+
+
+PROPERTIES = (
+    ('int in interval', SimpleProperty(int, min_=1, max_=1000, nullable=False), (0, 1, 500, 1000, 1001, None, '5')),
+    ('str in set', SimpleProperty(str, in_=('to', 'cc', 'bcc')), ('to', 'bcc', 'x', '', None, 1)),
+    ('non empty str', SimpleProperty(str, nullable=False), ('address@example.com', '', None, b'x')),
+)
+
+
+def measure(validate, samples, number, repeat):
+    """:return: best total time of number validations of every sample"""
+    return min(sum(timeit.repeat('validate(value)', number=number, repeat=1,
+                                 globals={'validate': validate, 'value': value})[0] for value in samples)
+               for _ in range(repeat))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=200000, help='validations per sample value')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print('%-16s %14s %14s %8s' % ('property', 'is_valid ns', 'compiled ns', 'speedup'))
+    for name, prop, samples in PROPERTIES:
+        compiled = prop.compile_validator()
+        for value in samples:
+            expected = value is None and prop.nullable or prop.is_valid(value)
+            if compiled(value) != expected:
+                raise Exception('Compiled validator of %s disagrees on %r' % (name, value))
+        looped = measure(prop.is_valid, samples, args.number, args.repeat)
+        fused = measure(compiled, samples, args.number, args.repeat)
+        count = float(args.number * len(samples))
+        print('%-16s %14.1f %14.1f %7.1fx' % (name, looped / count * 1e9, fused / count * 1e9, looped / fused))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
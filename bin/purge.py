@@ -0,0 +1,37 @@
+#!env/bin/python
+
+"""
+Delete messages older than given age and remove stored part bodies (blobs) no message references.
+Run it periodically, e.g. from cron, against database of settings.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'SmtpTestServer', 'dummy'))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--older-than', type=float, help='age of deleted messages in days, only orphaned blobs '
+                        'are removed if not set')
+    parser.add_argument('--batch-size', type=int, default=1000, help='messages deleted in one transaction')
+    parser.add_argument('--recount', action='store_true', help='recompute blob references from message parts')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    from settings import engine
+    from mail_srv.retention import purge
+
+    args = parse_args(argv)
+    before = None
+    if args.older_than is not None:
+        before = datetime.utcnow() - timedelta(days=args.older_than)
+    deleted, removed = purge(engine, before, args.batch_size, args.recount)
+    print('deleted messages=%d removed blobs=%d' % (deleted, removed))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,6 +1,56 @@
 #!env/bin/python
 
 """Script for initializing python mail server."""
+import argparse
+import importlib
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'SmtpTestServer', 'dummy'))
+
+
+def load_class(path):
+    """
+    :param path: dotted path to class, e.g. package.module.Class
+    """
+    module_name, class_name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def print_totals(totals):
+    print(' '.join('%s=%d' % item for item in sorted(totals.items())))
+    sys.stdout.flush()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2525)
+    parser.add_argument('--selector', required=True,
+                        help='dotted path to router.router.RouteSelector implementation')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='count of worker processes sharing port through SO_REUSEPORT, 0 means cpu count')
+    parser.add_argument('--report-interval', type=float, default=5.0)
+    parser.add_argument('--max-connections', type=int, default=10000)
+    parser.add_argument('--max-message-size', type=int, default=50 * 1024 * 1024)
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    from core.server import ConnectionLimits, DummyServer
+    from core.supervisor import Supervisor
+    from router.router import Router
+
+    args = parse_args(argv)
+    selector_cls = load_class(args.selector)
+    limits = ConnectionLimits(max_connections=args.max_connections, max_message_size=args.max_message_size)
+    if args.workers == 1:
+        DummyServer(Router(selector_cls()), host=args.host, port=args.port, limits=limits).run()
+        return
+    supervisor = Supervisor(selector_cls, workers=args.workers or None, report_interval=args.report_interval,
+                            host=args.host, port=args.port, limits=limits)
+    supervisor.run(on_report=print_totals)
+
 
 if __name__ == '__main__':
-    pass
+    main(sys.argv[1:])
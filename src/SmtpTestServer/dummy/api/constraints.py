@@ -15,18 +15,33 @@ class Constraint(object):
             value = args[0]
         return self.is_valid(value)
 
+    def expression(self, namespace):
+        """
+        Source of python expression over `value` which is true for valid value, used by compile_validator.
+        Constants are registered in namespace. Default expression calls is_valid.
+        :type namespace: _Namespace
+        :rtype: str
+        """
+        return '%s(value)' % namespace.add(self.is_valid)
+
 
 class NotNull(Constraint):
 
     def is_valid(self, value):
         return value is not None
 
+    def expression(self, namespace):
+        return 'value is not None'
+
 
 class NotEmpty(Constraint):
 
     def is_valid(self, value):
         return True if value else False
 
+    def expression(self, namespace):
+        return 'value'
+
 
 class InInterval(Constraint):
     OPEN = 'o'
@@ -65,6 +80,18 @@ class InInterval(Constraint):
     def is_valid(self, value):
         return self._lower(value) and self._upper(value)
 
+    def expression(self, namespace):
+        conditions = []
+        if self._lower == self._lower_inclusive:
+            conditions.append('%s <= value' % namespace.add(self._min))
+        elif self._lower is not InInterval._true:
+            conditions.append('%s < value' % namespace.add(self._min))
+        if self._upper == self._upper_inclusive:
+            conditions.append('%s >= value' % namespace.add(self._max))
+        elif self._upper is not InInterval._true:
+            conditions.append('%s > value' % namespace.add(self._max))
+        return ' and '.join(conditions) or 'True'
+
     def _lower_inclusive(self, value):
         return self._min <= value
 
@@ -95,3 +122,59 @@ class InSet(Constraint):
 
     def is_valid(self, value):
         return value in self._set
+
+    def expression(self, namespace):
+        return 'value in %s' % namespace.add(frozenset(self._set))
+
+
+class _Namespace(dict):
+    """Globals of generated validator, constants are bound under generated names."""
+
+    def add(self, constant):
+        name = '_c%d' % len(self)
+        self[name] = constant
+        return name
+
+
+def _condition(constraints, type_check, namespace):
+    expressions = [type_check(namespace)] if type_check is not None else []
+    expressions.extend(constraint.expression(namespace) for constraint in constraints)
+    return ' and '.join('(%s)' % expression for expression in expressions) or 'True'
+
+
+def _generate(source, namespace, name):
+    # plain dict globals, lookups in dict subclass miss interpreter global caches
+    generated = dict(namespace)
+    exec(compile(source, '<%s>' % name, 'exec'), generated)
+    return generated[name]
+
+
+def compile_validator(constraints, type_check=None, nullable=False, name='validate'):
+    """
+    Fuse type check and all constraints into single generated function, so validation is one call
+    instead of loop over bound methods.
+    :param constraints: constraints value has to satisfy, in order of evaluation
+    :param type_check: callable (namespace) -> expression source of type check, none if type is not checked
+    :param nullable: None is valid regardless of type check and constraints
+    :return: function (value) -> bool
+    :rtype: function
+    """
+    namespace = _Namespace()
+    condition = _condition(constraints, type_check, namespace)
+    if nullable:
+        condition = 'value is None or %s' % condition
+    return _generate('def %s(value):\n    return True if %s else False' % (name, condition), namespace, name)
+
+
+def compile_column_validator(constraints, type_check=None, nullable=False, name='validate_column'):
+    """
+    Same checks as compile_validator, applied over whole column of values in one generated loop.
+    :return: function (values) -> indexes of invalid values
+    :rtype: function
+    """
+    namespace = _Namespace()
+    condition = _condition(constraints, type_check, namespace)
+    if nullable:
+        condition = 'value is None or %s' % condition
+    return _generate('def %s(values):\n    return [index for index, value in enumerate(values) if not (%s)]'
+                     % (name, condition), namespace, name)
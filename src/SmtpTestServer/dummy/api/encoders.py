@@ -0,0 +1,63 @@
+"""JSON encoding of API responses, orjson when installed, stdlib json otherwise."""
+import json
+from datetime import date, datetime, time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj):
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return bytes(obj).decode('utf-8', 'replace')
+    raise TypeError('Object of type %s is not JSON serializable' % type(obj).__name__)
+
+
+if orjson is not None:
+    def dumps(obj):
+        """
+        :return: utf-8 encoded json, datetimes as ISO 8601 strings
+        :rtype: bytes
+        """
+        return orjson.dumps(obj, default=_default)
+else:
+    _encoder = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(obj):
+        return _encoder.encode(obj).encode('utf-8')
+
+
+def stream_array(items, chunk_size=100):
+    """
+    Encode iterable as json array piece by piece, whole document is never held in memory.
+    :param chunk_size: count of items encoded by one dumps call
+    :return: generator of utf-8 encoded parts of array
+    """
+    yield b'['
+    chunk = []
+    separator = b''
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            # items of encoded list without its brackets
+            yield separator + dumps(chunk)[1:-1]
+            separator = b','
+            chunk = []
+    if chunk:
+        yield separator + dumps(chunk)[1:-1]
+    yield b']'
+
+
+class JSONRenderer(object):
+    """Flask-API renderer using dumps, see settings.app DEFAULT_RENDERERS."""
+    media_type = 'application/json'
+    charset = None
+    handles_empty_responses = False
+
+    def render(self, data, media_type, **options):
+        return dumps(data)
@@ -1,4 +1,9 @@
+import os
+import re
+import threading
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
 
 
 class _Marshaller(object):
@@ -13,25 +18,219 @@ class _Marshaller(object):
         pass
 
 
+class MarshallerRegistry(object):
+    """
+    Thread safe registry of marshaller instances. Lookup of registered instance takes no lock,
+    lock is taken only when instance is created. Registry is emptied in forked child processes.
+    """
+
+    def __init__(self):
+        self._instances = {}
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        """
+        :param factory: callable creating instance for key, called once per process
+        """
+        instance = self._instances.get(key)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(key)
+                if instance is None:
+                    instance = self._instances[key] = factory()
+        return instance
+
+    def remove(self, key):
+        with self._lock:
+            self._instances.pop(key, None)
+
+    def stats(self):
+        """
+        :return: cache counters of registered marshallers which memoize conversions
+        :rtype: dict
+        """
+        return dict((self._key_name(key), instance.memo.stats()) for key, instance in list(self._instances.items())
+                    if getattr(instance, 'memo', None) is not None)
+
+    @staticmethod
+    def _key_name(key):
+        parts = key if isinstance(key, tuple) else (key,)
+        return ':'.join(getattr(part, '__name__', None) or str(part) for part in parts)
+
+
+REGISTRY = MarshallerRegistry()
+
+
 class MarshallerProvider(_Marshaller):
     __metaclass__ = ABCMeta
-    __MARSHALLER_DICT__ = {}
 
     @classmethod
     def get(cls):
-        if cls not in MarshallerProvider.__MARSHALLER_DICT__:
-            marshaller = cls()
-            MarshallerProvider.__MARSHALLER_DICT__[cls] = marshaller
-        return MarshallerProvider.__MARSHALLER_DICT__[cls]
+        return REGISTRY.get(cls, cls)
 
     @classmethod
     def remove(cls):
-        if cls not in MarshallerProvider.__MARSHALLER_DICT__:
-            return
-        del MarshallerProvider.__MARSHALLER_DICT__
+        REGISTRY.remove(cls)
 
     @staticmethod
     def get_for(cls):
         if hasattr(cls, 'get_marshaller'):
             return cls.get_marshaller().get()
-        raise Exception('Undefined marshaller')
\ No newline at end of file
+        raise Exception('Undefined marshaller')
+
+
+class Memo(object):
+    """Bounded LRU memo of recent conversions with hit and miss counters."""
+
+    def __init__(self, size=1024):
+        self._size = size
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, convert):
+        """
+        :return: memoized result of convert(key)
+        """
+        with self._lock:
+            try:
+                value = self._values[key]
+            except KeyError:
+                self.misses += 1
+            else:
+                self._values.move_to_end(key)
+                self.hits += 1
+                return value
+        value = convert(key)
+        with self._lock:
+            self._values[key] = value
+            if len(self._values) > self._size:
+                self._values.popitem(last=False)
+        return value
+
+    def stats(self):
+        """:rtype: dict"""
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._values),
+                'hit_rate': float(self.hits) / total if total else 0.0}
+
+
+# tokens of Y/M/d H:m:s style formats used by api models
+_PATTERN_TOKENS = (('Y', '%Y'), ('M', '%m'), ('d', '%d'), ('H', '%H'), ('m', '%M'), ('s', '%S'))
+# directive -> (width, datetime attribute)
+_FIXED_DIRECTIVES = {'%Y': (4, 'year'), '%m': (2, 'month'), '%d': (2, 'day'), '%H': (2, 'hour'),
+                     '%M': (2, 'minute'), '%S': (2, 'second')}
+_DIRECTIVE = re.compile(r'%.')
+
+ISO_8601 = 'iso'
+
+
+def strptime_format(format_):
+    """
+    :param format_: strptime format, or Y/M/d H:m:s style pattern without % directives
+    :rtype: str
+    """
+    if '%' in format_ or format_ == ISO_8601:
+        return format_
+    return ''.join(dict(_PATTERN_TOKENS).get(char, char) for char in format_)
+
+
+def _compile_fixed(format_):
+    """
+    :return: parse function of format made only of fixed width numeric directives, None if format
+        has any other directive
+    """
+    fields, literals = [], []
+    position = last = 0
+    for match in _DIRECTIVE.finditer(format_):
+        directive = _FIXED_DIRECTIVES.get(match.group())
+        if directive is None:
+            return None
+        literal = format_[last:match.start()]
+        literals.append((position, literal))
+        position += len(literal)
+        width, attribute = directive
+        fields.append((attribute, position, position + width))
+        position += width
+        last = match.end()
+    literal = format_[last:]
+    literals.append((position, literal))
+    length = position + len(literal)
+    attributes = [attribute for attribute, start, end in fields]
+    if len(set(attributes)) != len(attributes) or not set(('year', 'month', 'day')) <= set(attributes):
+        return None
+    # parser is generated, so field offsets and separators are constants of its code
+    checks = ['len(value) == %d' % length]
+    checks.extend('value[%d:%d] == %r' % (start, start + len(literal), literal)
+                  for start, literal in literals if literal)
+    checks.append('(%s).isdigit()' % ' + '.join('value[%d:%d]' % (start, end) for attribute, start, end in fields))
+    source = ('def parse(value):\n'
+              '    if %s:\n'
+              '        return datetime(%s)\n'
+              '    return None\n'
+              % (' and '.join(checks),
+                 ', '.join('%s=int(value[%d:%d])' % (attribute, start, end) for attribute, start, end in fields)))
+    namespace = {'datetime': datetime}
+    exec(compile(source, '<%s>' % format_, 'exec'), namespace)
+    return namespace['parse']
+
+
+class DateTimeMarshaller(_Marshaller):
+    """
+    Datetime marshaller of one format. ISO 8601 uses fromisoformat/isoformat, formats of fixed
+    width numeric fields are parsed by generated slicing parser, anything else by strptime.
+    Recent parsed values are memoized.
+    """
+
+    def __init__(self, format_, memo_size=1024):
+        self.format = strptime_format(format_)
+        self.memo = Memo(memo_size)
+        if self.format == ISO_8601:
+            self._parse, self._format = datetime.fromisoformat, datetime.isoformat
+            return
+        self._parse, self._format = self._strptime, self._strftime
+        fast_parse = _compile_fixed(self.format)
+        if fast_parse is not None:
+
+            def parse(value):
+                # values of other shape, e.g. without zero padding, are left to strptime
+                parsed = fast_parse(value)
+                return parsed if parsed is not None else self._strptime(value)
+            self._parse = parse
+
+    @staticmethod
+    def for_format(format_):
+        """
+        :return: process wide marshaller of format
+        :rtype: DateTimeMarshaller
+        """
+        return REGISTRY.get((DateTimeMarshaller, format_), lambda: DateTimeMarshaller(format_))
+
+    def _strptime(self, value):
+        return datetime.strptime(value, self.format)
+
+    def _strftime(self, value):
+        return value.strftime(self.format)
+
+    def unmarshall(self, value):
+        """
+        :type value: str
+        :rtype: datetime
+        """
+        if isinstance(value, datetime):
+            return value
+        return self.memo.get(value, self._parse)
+
+    def marshall(self, value):
+        """
+        :type value: datetime
+        :rtype: str
+        """
+        return self._format(value)
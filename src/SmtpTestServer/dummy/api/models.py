@@ -1,9 +1,15 @@
 from datetime import datetime
 
 from abc import ABCMeta, abstractmethod, abstractproperty
-from constraints import InInterval, InSet, NotEmpty, NotNull
+from api.constraints import InInterval, InSet, NotEmpty, NotNull, compile_column_validator, compile_validator
+from api.marshallers import DateTimeMarshaller
 from utils import load_arg, tuplify
 
+try:
+    _NUMBER_TYPES = (int, float, long)
+except NameError:
+    _NUMBER_TYPES = (int, float)
+
 
 class Property(object):
     __metaclass__ = ABCMeta
@@ -13,7 +19,8 @@ class Property(object):
         getter = load_arg(1, 'get', *args, **kwargs)
         setter = load_arg(2, 'set', *args, **kwargs)
 
-        self._constraints = kwargs.pop('constraints', default=tuple())
+        self._constraints = tuple(kwargs.pop('constraints', tuple()))
+        self._nullable = not any(isinstance(constraint, NotNull) for constraint in self._constraints)
         self._name = name
         self._type = type_
         self._getter = getter
@@ -35,6 +42,18 @@ class Property(object):
     def has_setter(self):
         return self._setter is not None
 
+    @property
+    def nullable(self):
+        return self._nullable
+
+    @property
+    def getter(self):
+        return self._getter
+
+    @property
+    def setter(self):
+        return self._setter
+
     @property
     def use_name(self):
         return True if self._name else False
@@ -51,11 +70,45 @@ class Property(object):
             return True
         return False
 
+    def type_expression(self, namespace):
+        """
+        :return: source of python expression over `value` checking its type, see constraints.compile_validator
+        :rtype: str
+        """
+        return '%s(value)' % namespace.add(self.check_type)
+
+    def compile_validator(self):
+        """
+        :return: generated function equivalent to is_valid, None passes for nullable properties
+        :rtype: function
+        """
+        return compile_validator(self._constraints, self.type_expression, self._nullable,
+                                 'validate_%s' % (self._type.__name__ if isinstance(self._type, type) else 'value'))
+
+    def compile_column_validator(self):
+        """
+        :return: generated function returning indexes of invalid values of whole column
+        :rtype: function
+        """
+        return compile_column_validator(self._constraints, self.type_expression, self._nullable)
+
+    def load_converter(self):
+        """
+        :return: callable converting wire value to model value, None if no conversion is needed
+        """
+        return None
+
+    def dump_converter(self):
+        """
+        :return: callable converting model value to wire value, None if no conversion is needed
+        """
+        return None
+
 
 class SimpleProperty(Property):
     def __init__(self, type_, *args, **kwargs):
         constraints = []
-        if type_ in (int, float, long):
+        if type_ in _NUMBER_TYPES:
             _max = load_arg(4, 'max_', *args, **kwargs)
             _min = load_arg(3, 'min_', *args, **kwargs)
             if _max or _min:
@@ -81,6 +134,9 @@ class SimpleProperty(Property):
     def check_type(self, value):
         return type(value) is self._type
 
+    def type_expression(self, namespace):
+        return 'type(value) is %s' % namespace.add(self._type)
+
     def is_simple(self):
         return True
 
@@ -90,12 +146,13 @@ class MarshallableProperty(Property):
     def __init__(self, type_, *args, **kwargs):
         constraints = []
         _marshaller = load_arg(3, 'marshaller', *args, **kwargs)
-        if not _marshaller:
+        # subclasses overriding marshall and unmarshall do not need marshaller
+        if not _marshaller and type(self).marshall is MarshallableProperty.marshall:
             raise Exception('Can not create marshaller property without marshaller')
-        if type(_marshaller) is not type or issubclass(_marshaller, MarshallableProperty):
+        if _marshaller and (type(_marshaller) is not type or issubclass(_marshaller, MarshallableProperty)):
             raise Exception('Expected marshaller type is subclass of MarshallerProvider')
         self._marshaller = _marshaller
-        _null = load_arg(4, 'nullable', default_=True *args, **kwargs)
+        _null = load_arg(4, 'nullable', default_=True, *args, **kwargs)
         if not _null:
             constraints.append(NotNull())
         _in_set = load_arg(5, 'in_', default_=tuple(), *args, **kwargs)
@@ -118,6 +175,12 @@ class MarshallableProperty(Property):
         dct[name] = self.unmarshall(value)
         return dct
 
+    def load_converter(self):
+        return self.unmarshall
+
+    def dump_converter(self):
+        return self.marshall
+
     def to_dict(self, dct, name):
         value = dct[name]
         dct[name] = self.marshall(value)
@@ -126,6 +189,9 @@ class MarshallableProperty(Property):
     def check_type(self, value):
         return isinstance(value, self._type)
 
+    def type_expression(self, namespace):
+        return 'isinstance(value, %s)' % namespace.add(self._type)
+
     def is_simple(self):
         return False
 
@@ -139,6 +205,9 @@ class ModelProperty(Property):
     def check_type(self, value):
         return isinstance(value, self._type)
 
+    def type_expression(self, namespace):
+        return 'isinstance(value, %s)' % namespace.add(self._type)
+
     def convert(self, dct, name):
         value = dct[name]
         if self.check_type(value):
@@ -151,24 +220,53 @@ class ModelProperty(Property):
 
     def to_dict(self, dct, name):
         value = dct[name]
-        model_dct = self._type.load(value)
+        model_dct = self._type.dumps(value)
         dct[name] = model_dct
         return dct
 
+    def load_converter(self):
+        model = self._type
+
+        def load(value):
+            if isinstance(value, model):
+                return value
+            if type(value) is not dict:
+                raise Exception('Property have to be dict type in order to unmarshall it')
+            return model.load(value)
+        return load
+
+    def dump_converter(self):
+        return self._type.dumps
+
     def is_simple(self):
         return False
 
 
 class DateTimeProperty(MarshallableProperty):
     def __init__(self, format_, constraints=None):
-        super(DateTimeProperty, self).__init__(format_, constraints)
+        super(DateTimeProperty, self).__init__(datetime, constraints=constraints or tuple())
         self._format = format_
 
+    # marshaller is looked up on every use, forked child gets own instance from emptied registry
     def marshall(self, value):
-        return datetime.strftime(self._format)
+        return DateTimeMarshaller.for_format(self._format).marshall(value)
 
     def unmarshall(self, value):
-        return datetime.strptime(value, self._format)
+        return DateTimeMarshaller.for_format(self._format).unmarshall(value)
+
+    def load_converter(self):
+        format_ = self._format
+
+        def load(value):
+            return DateTimeMarshaller.for_format(format_).unmarshall(value)
+        return load
+
+    def dump_converter(self):
+        format_ = self._format
+
+        def dump(value):
+            return DateTimeMarshaller.for_format(format_).marshall(value)
+        return dump
 
 
 class ListOfModelsProperty(Property):
@@ -211,55 +309,193 @@ class ListOfModelsProperty(Property):
         dct[name] = marshaled
         return dct
 
+    def load_converter(self):
+        model = self._type
+
+        def load(values):
+            if type(values) is not list:
+                raise Exception('Expected list property')
+            return model.load_many(values)
+        return load
+
+    def dump_converter(self):
+        model = self._type
+
+        def dump(values):
+            return model.dumps_many(values) if values is not None else None
+        return dump
+
     def is_simple(self):
         return False
 
 
-class ApiModel(object):
-    __metaclass__ = ABCMeta
+class ValidationError(Exception):
+    """Invalid rows of batch, see ApiModel.load_batch."""
+
+    def __init__(self, errors):
+        """
+        :param errors: indexes of invalid rows by wire name
+        :type errors: dict<str, list<int>>
+        """
+        self.errors = errors
+        self.rows = sorted(set(index for indexes in errors.values() for index in indexes))
+        super(ValidationError, self).__init__('Invalid rows %s' % self.rows)
+
+
+class ApiModelMeta(ABCMeta):
+    """Compiles field plan of every ApiModel class when class is created."""
+
+    def __init__(cls, name, bases, dct):
+        super(ApiModelMeta, cls).__init__(name, bases, dct)
+        cls._plan = cls._compile_plan()
+
+
+_PlanBase = ApiModelMeta('_PlanBase', (object,), {'_compile_plan': classmethod(lambda cls: ())})
+
+
+class ApiModel(_PlanBase):
     __EMPTY__ = object()
 
     @classmethod
     def _properties(cls):
         """
-        :returns: defined model properties
-        :rtype: __generator<[str, Property]>
+        :returns: defined model properties, inherited ones included, in definition order
+        :rtype: list<[str, Property]>
         """
-        return ((name, prop) for name, prop in cls.__dict__.iteritems() if isinstance(prop, Property))
+        props = {}
+        for klass in reversed(cls.__mro__):
+            for name, prop in klass.__dict__.items():
+                if isinstance(prop, Property):
+                    props.pop(name, None)
+                    props[name] = prop
+        return list(props.items())
+
+    @classmethod
+    def _compile_plan(cls):
+        """
+        :return: ordered fields (wire name, attribute name, validator, load converter, dump converter,
+            getter, setter, property, column validator)
+        :rtype: tuple<tuple>
+        """
+        plan = []
+        for name, prop in cls._properties():
+            plan.append((prop.name if prop.use_name else name, name, prop.compile_validator(),
+                         prop.load_converter(), prop.dump_converter(), prop.getter, prop.setter, prop,
+                         prop.compile_column_validator()))
+        return tuple(plan)
 
     @classmethod
     def load(cls, dct):
+        return cls._load(cls._plan, dct)
+
+    @classmethod
+    def load_many(cls, dcts):
+        plan = cls._plan
+        return [cls._load(plan, dct) for dct in dcts]
+
+    @classmethod
+    def validate_many(cls, dcts):
+        """
+        Columnar validation of batch, each field is checked over whole column at once.
+        :type dcts: list<dict>
+        :return: indexes of invalid rows by wire name, empty for valid batch
+        :rtype: dict<str, list<int>>
+        """
+        return cls._load_columns(cls._plan, dcts)[1]
+
+    @classmethod
+    def load_batch(cls, dcts):
+        """
+        Load batch column by column, whole batch is validated before any object is created.
+        :raises ValidationError: with all invalid rows of batch
+        :rtype: list<ApiModel>
+        """
+        plan = cls._plan
+        columns, errors = cls._load_columns(plan, dcts)
+        if errors:
+            raise ValidationError(errors)
+        loaded = [cls() for _ in dcts]
+        for (_, name, _, _, _, _, setter, _, _), column in zip(plan, columns):
+            if setter is not None:
+                for obj, value in zip(loaded, column):
+                    getattr(obj, setter)(value)
+            else:
+                for obj, value in zip(loaded, column):
+                    setattr(obj, name, value)
+        return loaded
+
+    @staticmethod
+    def _load_columns(plan, dcts):
+        """
+        :return: converted value columns in plan order and indexes of invalid rows by wire name
+        """
+        columns, errors = [], {}
+        missing = ApiModel.__EMPTY__
+        for wire_name, _, _, converter, _, _, _, _, column_validator in plan:
+            column = [dct.get(wire_name, missing) for dct in dcts]
+            failed = set()
+            if converter is not None:
+                for index, value in enumerate(column):
+                    if value is missing:
+                        continue
+                    try:
+                        column[index] = converter(value)
+                    except Exception:
+                        failed.add(index)
+            # missing values fail type check of every property
+            failed.update(column_validator(column))
+            if failed:
+                errors[wire_name] = sorted(failed)
+            columns.append(column)
+        return columns, errors
+
+    @classmethod
+    def _load(cls, plan, dct):
         unmarshalled = cls()
-        for name, prop in cls._properties():
-            if prop.use_name:
-                name = prop.name
-            if name not in dct:
-                raise Exception('Property does not exist')
-            if not prop.is_simple:
-                prop.convert(dct, name)
-            if prop.is_valid(dct[name]):
-                raise Exception('Invalid property value')
-            if prop.has_setter:
-                setter = getattr(unmarshalled, prop.setter)
-                setter(dct[name])
+        for wire_name, name, validator, converter, _, _, setter, _, _ in plan:
+            if wire_name not in dct:
+                raise Exception('Property %s does not exist' % wire_name)
+            value = dct[wire_name]
+            if converter is not None:
+                value = converter(value)
+            if not validator(value):
+                raise Exception('Invalid property value %s' % wire_name)
+            if setter is not None:
+                getattr(unmarshalled, setter)(value)
             else:
-                setattr(unmarshalled, name, dct[name])
+                setattr(unmarshalled, name, value)
         return unmarshalled
 
     @classmethod
     def dumps(cls, obj):
         if not isinstance(obj, cls):
             raise Exception('Invalid type')
+        return cls._dumps(cls._plan, obj)
+
+    @classmethod
+    def dumps_many(cls, objs):
+        plan = cls._plan
+        marshaled = []
+        for obj in objs:
+            if not isinstance(obj, cls):
+                raise Exception('Invalid type')
+            marshaled.append(cls._dumps(plan, obj))
+        return marshaled
+
+    @staticmethod
+    def _dumps(plan, obj):
         marshaled = {}
-        for name, prop in cls._properties():
-            if prop.use_name:
-                name = prop.name
-            value = getattr(obj, name, ApiModel.__EMPTY__)
-            if value is ApiModel.__EMPTY__ and not prop.is_nullable:
-                raise Exception('Undefined property %s' % name)
-            marshaled[name] = value
-            if not prop.is_valid(value):
-                raise Exception('Invalid value for property %s' % name)
-            if not prop.is_simple:
-                prop.to_dict(marshaled, name)
+        for wire_name, name, validator, _, converter, getter, _, prop, _ in plan:
+            if getter is not None:
+                value = getattr(obj, getter)()
+            else:
+                value = getattr(obj, name, ApiModel.__EMPTY__)
+                if value is prop or value is ApiModel.__EMPTY__:
+                    if not prop.nullable:
+                        raise Exception('Undefined property %s' % wire_name)
+                    value = None
+            if not validator(value):
+                raise Exception('Invalid value for property %s' % wire_name)
+            marshaled[wire_name] = converter(value) if converter is not None and value is not None else value
         return marshaled
+
@@ -0,0 +1 @@
+"""Load generator and benchmark scenarios driven by bin/bench.py."""
@@ -0,0 +1,193 @@
+"""Asynchronous SMTP load generator."""
+import asyncio
+import random
+import time
+
+
+CRLF = b'\r\n'
+
+# (size in bytes, weight)
+DEFAULT_SIZE_MIX = ((2 * 1024, 70), (32 * 1024, 25), (512 * 1024, 5))
+
+
+class SmtpError(Exception):
+    pass
+
+
+def percentile(values, q):
+    """
+    :param values: sorted values
+    :param q: percentile in [0, 100]
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))]
+
+
+class MessageFactory(object):
+    """Creates messages of size drawn from weighted size mix, each one sent to fan_out recipients."""
+
+    def __init__(self, size_mix=DEFAULT_SIZE_MIX, fan_out=1, seed=0, domain='example.com'):
+        """
+        :param size_mix: (approximate size in bytes, weight) pairs
+        :param fan_out: count of recipients of each message
+        """
+        self._sizes = [size for size, weight in size_mix]
+        self._weights = [weight for size, weight in size_mix]
+        self._fan_out = fan_out
+        self._random = random.Random(seed)
+        self._domain = domain
+        self._sequence = 0
+
+    def create(self):
+        """
+        :return: (sender, recipients, message data terminated by dot line)
+        :rtype: tuple
+        """
+        self._sequence += 1
+        size = self._random.choices(self._sizes, self._weights)[0]
+        sender = 'sender%d@%s' % (self._sequence % 100, self._domain)
+        recipients = ['user%d@%s' % ((self._sequence + idx) % 1000, self._domain) for idx in range(self._fan_out)]
+        headers = ('From: Load <%s>\r\nTo: %s\r\nSubject: load message %d\r\nMessage-ID: <%d@%s>\r\n'
+                   'Content-Type: text/plain; charset=utf-8\r\n\r\n'
+                   % (sender, ', '.join(recipients), self._sequence, self._sequence, self._domain)).encode('ascii')
+        line = ('load test body line %d ' % self._sequence).encode('ascii').ljust(76, b'x') + CRLF
+        body = line * max(1, (size - len(headers)) // len(line))
+        return sender, recipients, headers + body + b'.' + CRLF
+
+
+class _Client(object):
+    """SMTP client pipelining commands and sending messages with BDAT if server supports it."""
+
+    def __init__(self, host, port, timeout, extensions=True):
+        """
+        :param extensions: use PIPELINING and CHUNKING when advertised
+        """
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self._use_extensions = extensions
+        self._reader = None
+        self._writer = None
+        self.extensions = set()
+
+    async def _reply(self):
+        """:return: (reply code, lines of possibly multiline reply)"""
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self._reader.readuntil(CRLF), self._timeout)
+            lines.append(line[4:].rstrip(CRLF).decode('ascii', 'replace'))
+            if line[3:4] != b'-':
+                return int(line[:3]), lines
+
+    async def _check(self, command, expected):
+        code = (await self._reply())[0]
+        if code not in expected:
+            raise SmtpError('%s replied %d' % (command.split(b' ', 1)[0].decode('ascii'), code))
+        return code
+
+    async def _command(self, command, expected):
+        self._writer.write(command + CRLF)
+        return await self._check(command, expected)
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self._host, self._port, limit=1024 * 1024)
+        if (await self._reply())[0] != 220:
+            raise SmtpError('Server is not ready')
+        self._writer.write(b'EHLO loadgen' + CRLF)
+        code, lines = await self._reply()
+        if code != 250:
+            raise SmtpError('EHLO replied %d' % code)
+        if self._use_extensions:
+            self.extensions = set(line.split(' ', 1)[0].upper() for line in lines[1:])
+
+    async def send(self, sender, recipients, data):
+        """
+        :param data: message terminated by dot line
+        """
+        commands = [('MAIL FROM:<%s>' % sender).encode('ascii') + CRLF]
+        commands.extend(('RCPT TO:<%s>' % recipient).encode('ascii') + CRLF for recipient in recipients)
+        expected = [(250,)] + [(250, 251)] * len(recipients)
+        if 'CHUNKING' in self.extensions:
+            # BDAT payload is not dot stuffed, messages of factory have no line starting with dot
+            payload = data[:-3]
+            commands.append(b'BDAT %d LAST' % len(payload) + CRLF + payload)
+            expected.append((250,))
+        else:
+            commands.append(b'DATA' + CRLF)
+            expected.append((354,))
+        pipelining = 'PIPELINING' in self.extensions
+        if pipelining:
+            self._writer.write(b''.join(commands))
+        for command, codes in zip(commands, expected):
+            if not pipelining:
+                self._writer.write(command)
+            await self._check(command, codes)
+        if commands[-1] == b'DATA' + CRLF:
+            self._writer.write(data)
+            await self._check(b'DATA', (250,))
+
+    async def close(self):
+        if self._writer is None:
+            return
+        try:
+            await self._command(b'QUIT', (221,))
+        except (SmtpError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass
+        self._writer.close()
+        self._writer = None
+
+
+async def _worker(host, port, factory, remaining, reuse, timeout, extensions, latencies, errors):
+    client = None
+    sent_on_connection = 0
+    while remaining[0] > 0:
+        remaining[0] -= 1
+        sender, recipients, data = factory.create()
+        try:
+            if client is None:
+                client = _Client(host, port, timeout, extensions)
+                await client.connect()
+            started = time.perf_counter()
+            await client.send(sender, recipients, data)
+            latencies.append(time.perf_counter() - started)
+            sent_on_connection += 1
+        except (SmtpError, ConnectionError, OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            if client is not None:
+                await client.close()
+            client, sent_on_connection = None, 0
+            continue
+        if reuse and sent_on_connection >= reuse:
+            await client.close()
+            client, sent_on_connection = None, 0
+    if client is not None:
+        await client.close()
+
+
+async def run_load(host, port, messages, concurrency=10, reuse=0, factory=None, timeout=30.0, extensions=True):
+    """
+    Send messages over concurrent connections.
+    :param reuse: messages sent over one connection before reconnecting, 0 keeps connection for all of them
+    :param extensions: pipeline commands and send messages with BDAT when server advertises it
+    :param factory: message factory, default size mix with single recipient if none
+    :type factory: MessageFactory
+    :return: throughput and accept latency (MAIL FROM to reply of DATA) summary
+    :rtype: dict
+    """
+    factory = factory or MessageFactory()
+    remaining, latencies, errors = [messages], [], {}
+    started = time.perf_counter()
+    await asyncio.gather(*[_worker(host, port, factory, remaining, reuse, timeout, extensions, latencies, errors)
+                           for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'messages': len(latencies),
+        'errors': errors,
+        'seconds': elapsed,
+        'messages_per_second': len(latencies) / elapsed if elapsed else 0.0,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p99': percentile(latencies, 99),
+        'latency_max': latencies[-1] if latencies else 0.0,
+    }
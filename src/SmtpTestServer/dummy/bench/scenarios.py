@@ -0,0 +1,218 @@
+"""
+Benchmark scenarios of ingest (SMTP -> Router -> storage), /inbox/ reads and /search queries, run in one process.
+settings have to be configured through environment before this module is imported, see bin/bench.py.
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from bench.loadgen import DEFAULT_SIZE_MIX, MessageFactory, percentile, run_load
+from core.server import DummyServer
+from router.router import Route, RouteSelector, Router
+
+
+SCENARIOS = OrderedDict([
+    ('small', {'size_mix': ((1024, 1),), 'fan_out': 1, 'concurrency': 20, 'reuse': 0}),
+    ('mixed', {'size_mix': DEFAULT_SIZE_MIX, 'fan_out': 1, 'concurrency': 20, 'reuse': 0}),
+    ('fan_out', {'size_mix': ((4 * 1024, 1),), 'fan_out': 10, 'concurrency': 20, 'reuse': 0}),
+    ('reconnect', {'size_mix': ((2 * 1024, 1),), 'fan_out': 1, 'concurrency': 50, 'reuse': 1}),
+])
+
+
+def memory_usage():
+    """
+    :return: current and peak resident set size of this process in MiB
+    :rtype: dict
+    """
+    usage = {'rss_mb': 0.0, 'peak_rss_mb': 0.0}
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    usage['rss_mb'] = int(line.split()[1]) / 1024.0
+                elif line.startswith('VmHWM:'):
+                    usage['peak_rss_mb'] = int(line.split()[1]) / 1024.0
+    except IOError:
+        import resource
+        usage['peak_rss_mb'] = usage['rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return usage
+
+
+class SinkRoute(Route, RouteSelector):
+    """Selector routing every recipient to one sink."""
+    recipient_only = True
+
+    def __init__(self, sink):
+        self._sink = sink
+
+    def get_route(self, message, to, from_):
+        return self
+
+    def send(self, message, from_, to):
+        self._sink.receive(message, from_, to)
+
+
+class ServerThread(object):
+    """DummyServer running on own event loop in background thread."""
+
+    def __init__(self, server):
+        self.server = server
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name='bench-server')
+        self._thread.daemon = True
+        self._started = threading.Event()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self.server.start())
+        self._started.set()
+        self._loop.run_forever()
+
+    def start(self):
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self.server.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+def create_sink(storage):
+    """
+    :param storage: 'memory' or 'database'
+    :return: (sink, function waiting until everything is stored and returning stored count)
+    """
+    if storage == 'memory':
+        from mail_srv.storage import get_storage
+        sink = get_storage()
+        initial = len(sink) + sink.evicted
+        return sink, lambda: len(sink) + sink.evicted - initial
+    import settings
+    from mail_srv.writer import BatchWriter
+    writer = BatchWriter(settings.engine)
+    writer.start()
+
+    def drain():
+        writer.stop()
+        return writer.flushed_messages
+    return writer, drain
+
+
+def run_ingest(name, messages, storage, host='127.0.0.1', port=2526, extensions=True):
+    """
+    Send messages of scenario to in process server storing them.
+    :param extensions: let load generator use PIPELINING and CHUNKING
+    :rtype: dict
+    """
+    options = SCENARIOS[name]
+    sink, drain = create_sink(storage)
+    server = ServerThread(DummyServer(Router(SinkRoute(sink)), host, port))
+    server.start()
+    try:
+        factory = MessageFactory(options['size_mix'], options['fan_out'])
+        result = asyncio.run(run_load(host, port, messages, options['concurrency'], options['reuse'], factory,
+                                      extensions=extensions))
+    finally:
+        server.stop()
+    started = time.perf_counter()
+    result['stored'] = drain()
+    result['drain_seconds'] = time.perf_counter() - started
+    result.update(memory_usage())
+    result.update(options)
+    result['extensions'] = extensions
+    result['size_mix'] = [list(item) for item in options['size_mix']]
+    return result
+
+
+def run_inbox(requests, page_size=50):
+    """
+    Read /inbox/ pages through Flask test client, following X-Next-Cursor and restarting at first page.
+    :rtype: dict
+    """
+    from mail_srv import controllers
+    client = controllers.app.test_client()
+    latencies, received, cursor = [], 0, None
+    started = time.perf_counter()
+    for _ in range(requests):
+        url = '/inbox/?limit=%d' % page_size + ('&cursor=%s' % cursor if cursor else '')
+        request_started = time.perf_counter()
+        response = client.get(url)
+        body = response.get_data()
+        latencies.append(time.perf_counter() - request_started)
+        if response.status_code != 200:
+            raise Exception('%s returned %d' % (url, response.status_code))
+        received += len(body)
+        cursor = response.headers.get('X-Next-Cursor')
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': requests,
+        'page_size': page_size,
+        'seconds': elapsed,
+        'requests_per_second': requests / elapsed if elapsed else 0.0,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p99': percentile(latencies, 99),
+        'bytes': received,
+    }
+
+
+def run_search(requests, query='load message', page_size=50):
+    """
+    Query /search through Flask test client, every message sent by load generator matches default query.
+    :rtype: dict
+    """
+    from mail_srv import controllers
+    client = controllers.app.test_client()
+    url = '/search?q=%s&limit=%d' % (query.replace(' ', '+'), page_size)
+    latencies, matched = [], None
+    started = time.perf_counter()
+    for _ in range(requests):
+        request_started = time.perf_counter()
+        response = client.get(url)
+        body = response.get_data()
+        latencies.append(time.perf_counter() - request_started)
+        if response.status_code != 200:
+            raise Exception('%s returned %d' % (url, response.status_code))
+        if matched is None:
+            matched = len(json.loads(body))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': requests,
+        'page_size': page_size,
+        'matched': matched or 0,
+        'seconds': elapsed,
+        'requests_per_second': requests / elapsed if elapsed else 0.0,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p99': percentile(latencies, 99),
+    }
+
+
+# result keys compared against baseline, True if higher value is better
+COMPARED = (('messages_per_second', True), ('latency_p99', False), ('requests_per_second', True),
+            ('peak_rss_mb', False))
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    :param tolerance: relative change considered as noise
+    :return: (scenario, key, baseline value, current value, relative change, regression) rows
+    :rtype: list<tuple>
+    """
+    rows = []
+    for name, result in results['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if base is None:
+            continue
+        for section in ('ingest', 'inbox', 'search'):
+            current, previous = result.get(section) or {}, base.get(section) or {}
+            for key, higher_is_better in COMPARED:
+                if not previous.get(key) or key not in current:
+                    continue
+                change = (current[key] - previous[key]) / float(previous[key])
+                regression = change < -tolerance if higher_is_better else change > tolerance
+                rows.append(('%s.%s' % (name, section), key, previous[key], current[key], change, regression))
+    return rows
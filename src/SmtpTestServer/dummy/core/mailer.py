@@ -1,6 +1,7 @@
+from collections import OrderedDict
 from datetime import datetime
 from abc import ABCMeta, abstractmethod
-from __init__ import tuplify
+from core import tuplify
 
 
 class Constraints(object):
@@ -35,71 +36,157 @@ class Constraints(object):
         pass
 
 
-class Parseable(object):
+class _Field(object):
+    """
+    Data descriptor of Parseable field, value is kept in slot of instance. Parse, cast and
+    validation steps of field constraints are bound once, when class is created.
+    """
+    __slots__ = ('name', 'constraints', '_slot', '_parse', '_is_assignable', '_needs_cast', '_cast', '_validate',
+                 '_zero')
+
+    def __init__(self, name, constraints, slot):
+        self.name = name
+        self.constraints = constraints
+        self._slot = slot
+        self._parse = constraints.parse
+        self._is_assignable = constraints.is_assignable
+        self._needs_cast = constraints.needs_cast
+        self._cast = constraints.cast
+        self._validate = constraints.validate
+        self._zero = constraints.zero
+
+    def convert(self, value):
+        """
+        :return: parsed, casted and validated value
+        :raises ValueError: invalid value
+        """
+        parsed_value = self._parse(value)
+        if not self._is_assignable(parsed_value):
+            raise Exception('Value %s is not assignable to %s' % (str(parsed_value), self.name))
+        if self._needs_cast(parsed_value):
+            parsed_value = self._cast(parsed_value)
+        if not self._validate(parsed_value):
+            raise ValueError('Invalid value:\n%s' % self.constraints.create_error_message(parsed_value))
+        return parsed_value
+
+    def is_assigned(self, obj):
+        try:
+            self._slot.__get__(obj)
+        except AttributeError:
+            return False
+        return True
 
-    def __init__(self):
-        self._values = dict()
-        self._non_empty = False
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        try:
+            return self._slot.__get__(obj)
+        except AttributeError:
+            return self._zero()
+
+    def __set__(self, obj, value):
+        self._slot.__set__(obj, self.convert(value))
+
+    def __delete__(self, obj):
+        self._slot.__delete__(obj)
+
+
+def _slot_name(name):
+    return '_f_%s' % name
+
+
+class ParseableMeta(ABCMeta):
+    """Turns Constraints class attributes into slotted _Field descriptors and builds field table."""
+
+    def __new__(mcs, name, bases, dct):
+        constraints = [(key, value) for key, value in dct.items() if isinstance(value, Constraints)]
+        for key, value in constraints:
+            del dct[key]
+        dct['__slots__'] = tuple(dct.get('__slots__', ())) + tuple(_slot_name(key) for key, _ in constraints)
+        cls = super(ParseableMeta, mcs).__new__(mcs, name, bases, dct)
+        fields = OrderedDict()
+        for base in reversed(cls.__mro__[1:]):
+            fields.update(getattr(base, '_fields', ()))
+        for key, value in constraints:
+            field = _Field(key, value, cls.__dict__[_slot_name(key)])
+            setattr(cls, key, field)
+            fields[key] = field
+        cls._fields = fields
+        return cls
 
-    def __new__(cls, *args, **kwargs):
-        pass
 
-    def __setattr__(self, key, value):
-        self._set_value(key, value)
+_ParseableBase = ParseableMeta('_ParseableBase', (object,), {'__slots__': ()})
 
-    def __getattr__(self, item):
-        return self._get_value(name=item)
 
-# override __set__ and __get__
+class Parseable(_ParseableBase):
+    """
+    Object with typed fields, declared as Constraints class attributes. Values are parsed, casted
+    and validated on assignment, unassigned fields read as zero of their constraints.
+    """
+    __slots__ = ('_non_empty',)
+
+    def __init__(self):
+        self._non_empty = False
+
+    @classmethod
+    def from_dict(cls, dct):
+        """
+        Create object from dict, all values are validated before object is created.
+        :raises ValueError: with every invalid or unknown field
+        """
+        fields = cls._fields
+        values, errors = [], []
+        for name, value in dct.items():
+            field = fields.get(name)
+            if field is None:
+                errors.append('Invalid field name %s' % name)
+                continue
+            try:
+                values.append((field, field.convert(value)))
+            except Exception as e:
+                errors.append('%s: %s' % (name, e))
+        if errors:
+            raise ValueError('\n'.join(errors))
+        obj = cls()
+        for field, value in values:
+            field._slot.__set__(obj, value)
+        return obj
+
     def _set_value(self, name, value):
-        constraints = self.__class__._constraints(name)
-        if not constraints:
-            raise Exception('Invalid field name %s' % name)
-        parsed_value = constraints.parse(value)
-        if not constraints.is_assignable(parsed_value):
-            raise Exception('Value %s is not assignable to %s' % (str(parsed_value), name))
-        casted_value = parsed_value
-        if constraints.needs_cast(parsed_value):
-            casted_value = constraints.cast(parsed_value)
-        if not constraints.validate(casted_value):
-            raise ValueError('Invalid value:\n%s' % constraints.create_error_message(casted_value))
-        self._values[name] = casted_value
+        self._field(name).__set__(self, value)
 
     def _get_value(self, name):
-        constraints = self.__class__._constraints(name)
-        if not constraints:
-            raise Exception('Invalid field name %s' % name)
-        if name not in self._values:
-            return constraints.zero()
-        return self._values[name]
+        return self._field(name).__get__(self)
 
     def _is_assigned(self, name):
-        constraint = self.__class__._constraints(name)
-        if not constraint:
+        return self._field(name).is_assigned(self)
+
+    @classmethod
+    def _field(cls, name):
+        field = cls._fields.get(name)
+        if field is None:
             raise Exception('Invalid field name %s' % name)
-        return name in self._values
+        return field
 
     @property
     def only_assigned(self):
         return self._non_empty
 
-    @only_assigned.setter()
+    @only_assigned.setter
     def only_assigned(self, value):
-        if type(value) is bool:
-            self._non_empty = value
-        raise ValueError('Invalid type')
+        if type(value) is not bool:
+            raise ValueError('Invalid type')
+        self._non_empty = value
 
     def __iter__(self):
-        return ((name, self._get_value(name)) for name, constraint in self.__dict__.iteritems()\
-            if isinstance(constraint, Constraints) and (not self.only_assigned or self._is_assigned(name)))
+        only_assigned = self._non_empty
+        return ((name, field.__get__(self)) for name, field in self._fields.items()
+                if not only_assigned or field.is_assigned(self))
 
     @classmethod
     def _constraints(cls, name):
-        if name not in cls.__dict__:
-            raise Exception('Key %s does not exist in class')
-        if not isinstance(cls.__dict__[name], Constraints):
-            return None
-        return cls.__dict__[name]
+        field = cls._fields.get(name)
+        return field.constraints if field is not None else None
 
 
 class StringList(Constraints):
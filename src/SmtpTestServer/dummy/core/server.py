@@ -1,11 +1,525 @@
 #!/usr/bin/env python3
+"""Asyncio based SMTP listener, which hands received mail to router."""
+import asyncio
+import socket
+from concurrent.futures import ThreadPoolExecutor
 
-from smtplib import SMTPServer
+import metrics
+from core.spool import MessageSpool
+from router.pipeline import PipelineFull
+from router.router import DeliveryException, NoRouteException
 
 
-class DummyServer(SMTPServer):
+CRLF = b'\r\n'
+# size of pieces BDAT chunks are read in
+READ_SIZE = 64 * 1024
+# BODY values of MAIL FROM, payload is stored as received in both cases
+BODY_TYPES = ('7BIT', '8BITMIME')
 
-    def __init__(self, *args, **kwargs):
-        pass
+SMTP_CONNECTIONS = metrics.counter('smtp_connections_total', 'Accepted SMTP connections', ('result',))
+SMTP_ACTIVE = metrics.gauge('smtp_active_connections', 'Open SMTP sessions')
+SMTP_COMMAND_SECONDS = metrics.histogram('smtp_command_seconds', 'Duration of SMTP commands, DATA includes '
+                                         'receiving message', ('command',))
+SMTP_MESSAGES = metrics.counter('smtp_messages_total', 'Finished mail transactions by result', ('result',))
+SMTP_BYTES = metrics.counter('smtp_received_bytes_total', 'Size of queued messages')
+SMTP_DELIVER_SECONDS = metrics.histogram('smtp_deliver_seconds', 'Hand over of received message to router')
 
 
+class ConnectionLimits(object):
+    """Per connection (and per server) limits of SMTP listener."""
+
+    def __init__(self, max_connections=10000, max_line_length=1024, max_message_size=50 * 1024 * 1024,
+                 max_recipients=1000, max_messages=1000, idle_timeout=300.0):
+        """
+        :param max_connections: maximal count of concurrently open sessions
+        :param max_line_length: maximal length of command line (including CRLF)
+        :param max_message_size: maximal size of message payload (DATA or all BDAT chunks) in bytes
+        :param max_recipients: maximal count of RCPT TO commands per one mail transaction
+        :param max_messages: maximal count of messages accepted in one session
+        :param idle_timeout: seconds after which idle client is disconnected
+        :type: int|float
+        """
+        self.max_connections = max_connections
+        self.max_line_length = max_line_length
+        self.max_message_size = max_message_size
+        self.max_recipients = max_recipients
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+
+
+class _CloseSession(Exception):
+    pass
+
+
+# command line already answered by error reply, it is not dispatched
+_REJECTED_LINE = object()
+
+
+class _SessionReader(object):
+    """
+    Reads client stream into own buffer, so session can tell whether next pipelined command line
+    has already arrived without waiting for it.
+    """
+
+    def __init__(self, reader, limit):
+        """
+        :type reader: asyncio.StreamReader
+        :param limit: length of buffered data without separator which raises LimitOverrunError
+        """
+        self._reader = reader
+        self._limit = limit
+        self._buffer = bytearray()
+
+    def has_line(self):
+        """:return: True if whole line is buffered"""
+        return CRLF in self._buffer
+
+    async def _fill(self):
+        data = await self._reader.read(READ_SIZE)
+        if not data:
+            raise asyncio.IncompleteReadError(bytes(self._buffer), None)
+        self._buffer += data
+
+    async def readuntil(self, separator=CRLF):
+        """Same contract as asyncio.StreamReader.readuntil, partial data is kept on LimitOverrunError."""
+        start = 0
+        while True:
+            index = self._buffer.find(separator, start)
+            if index >= 0:
+                return self._take(index + len(separator))
+            if len(self._buffer) > self._limit:
+                raise asyncio.LimitOverrunError('Separator is not found, and chunk exceed the limit',
+                                                len(self._buffer))
+            start = max(0, len(self._buffer) - len(separator) + 1)
+            await self._fill()
+
+    async def readexactly(self, n):
+        while len(self._buffer) < n:
+            await self._fill()
+        return self._take(n)
+
+    def _take(self, n):
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return data
+
+
+class SMTPSession(object):
+    """
+    Single client connection, speaks minimal RFC 5321 dialect with PIPELINING (RFC 2920), CHUNKING (RFC 3030),
+    8BITMIME (RFC 6152) and SIZE (RFC 1870). Replies are buffered and written once no further pipelined
+    command is waiting in reader buffer.
+    """
+
+    def __init__(self, server, reader, writer):
+        self._server = server
+        self._limits = server.limits
+        self._reader = _SessionReader(reader, max(self._limits.max_line_length, READ_SIZE))
+        self._writer = writer
+        self._greeted = False
+        self._messages = 0
+        self._replies = []
+        self._chunks = None
+        self._commands = {
+            'HELO': self.smtp_helo,
+            'EHLO': self.smtp_ehlo,
+            'MAIL': self.smtp_mail,
+            'RCPT': self.smtp_rcpt,
+            'DATA': self.smtp_data,
+            'BDAT': self.smtp_bdat,
+            'RSET': self.smtp_rset,
+            'NOOP': self.smtp_noop,
+            'VRFY': self.smtp_vrfy,
+            'QUIT': self.smtp_quit,
+        }
+        self._reset()
+
+    def _reset(self):
+        self.mail_from = None
+        self.rcpt_to = []
+        if self._chunks is not None:
+            self._chunks.close()
+            self._chunks = None
+
+    async def handle(self):
+        self.push('220 %s ESMTP DummyServer' % self._server.hostname)
+        try:
+            while True:
+                if not self._has_pending_command():
+                    await self._flush()
+                line = await self._readline()
+                if line is None:
+                    break
+                if line is _REJECTED_LINE:
+                    continue
+                await self._dispatch(line)
+        except _CloseSession:
+            pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._reset()
+            try:
+                await self._flush()
+            except ConnectionError:
+                pass
+            self._writer.close()
+
+    def _has_pending_command(self):
+        """
+        :return: True if whole command line of pipelining client is already buffered, so its reply
+            can be sent together with the previous ones
+        """
+        return self._reader.has_line()
+
+    async def _flush(self):
+        if self._replies:
+            self._writer.write(b''.join(self._replies))
+            self._replies = []
+        await self._writer.drain()
+
+    async def _readline(self):
+        try:
+            line = await asyncio.wait_for(self._reader.readuntil(CRLF), self._limits.idle_timeout)
+        except asyncio.TimeoutError:
+            self.push('421 4.4.2 Idle timeout, closing connection')
+            raise _CloseSession()
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            self.push('500 5.5.2 Line too long')
+            raise _CloseSession()
+        if len(line) > self._limits.max_line_length:
+            self.push('500 5.5.2 Line too long')
+            return _REJECTED_LINE
+        return line
+
+    async def _read_data_line(self):
+        try:
+            return await asyncio.wait_for(self._reader.readuntil(CRLF), self._limits.idle_timeout)
+        except asyncio.TimeoutError:
+            self.push('421 4.4.2 Idle timeout, closing connection')
+            raise _CloseSession()
+        except asyncio.LimitOverrunError as e:
+            return await self._reader.readexactly(e.consumed)
+
+    async def _read_chunk(self, size, spool):
+        """
+        Read BDAT chunk of size bytes in pieces.
+        :param spool: spool chunk is written to, chunk is discarded if none
+        """
+        while size:
+            try:
+                data = await asyncio.wait_for(self._reader.readexactly(min(size, READ_SIZE)),
+                                              self._limits.idle_timeout)
+            except asyncio.TimeoutError:
+                self.push('421 4.4.2 Idle timeout, closing connection')
+                raise _CloseSession()
+            size -= len(data)
+            if spool is not None:
+                spool.write(data)
+
+    async def _dispatch(self, line):
+        line = line.rstrip(CRLF).decode('ascii', 'replace')
+        command, _, arg = line.partition(' ')
+        name = command.upper()
+        handler = self._commands.get(name)
+        if handler is None:
+            self.push('500 5.5.1 Command "%s" not recognized' % command)
+            return
+        with SMTP_COMMAND_SECONDS.labels(name).time():
+            await handler(arg.strip())
+
+    def push(self, reply):
+        self._replies.append(reply.encode('ascii') + CRLF)
+
+    async def smtp_helo(self, arg):
+        if not arg:
+            self.push('501 5.5.4 Syntax: HELO hostname')
+            return
+        self._greeted = True
+        self._reset()
+        self.push('250 %s' % self._server.hostname)
+
+    async def smtp_ehlo(self, arg):
+        if not arg:
+            self.push('501 5.5.4 Syntax: EHLO hostname')
+            return
+        self._greeted = True
+        self._reset()
+        lines = [self._server.hostname] + list(self._server.extensions())
+        for line in lines[:-1]:
+            self.push('250-%s' % line)
+        self.push('250 %s' % lines[-1])
+
+    async def smtp_mail(self, arg):
+        if not self._greeted:
+            self.push('503 5.5.1 Send HELO/EHLO first')
+            return
+        if self.mail_from is not None:
+            self.push('503 5.5.1 Nested MAIL command')
+            return
+        if self._messages >= self._limits.max_messages:
+            self.push('421 4.7.0 Too many messages in one session')
+            raise _CloseSession()
+        address, params = _parse_path(arg, 'FROM:')
+        if address is None:
+            self.push('501 5.5.4 Syntax: MAIL FROM:<address>')
+            return
+        for name, value in params:
+            if name == 'SIZE':
+                if not value or not value.isdigit():
+                    self.push('501 5.5.4 Syntax: SIZE=<size>')
+                    return
+                if int(value) > self._limits.max_message_size:
+                    self.push('552 5.3.4 Message size exceeds fixed maximum message size')
+                    self._server.stats['rejected'] += 1
+                    SMTP_MESSAGES.labels('oversized').inc()
+                    return
+            elif name == 'BODY':
+                if (value or '').upper() not in BODY_TYPES:
+                    self.push('501 5.5.4 Syntax: BODY=7BIT|8BITMIME')
+                    return
+            else:
+                self.push('555 5.5.4 MAIL FROM parameter %s not recognized' % name)
+                return
+        self.mail_from = address
+        self.push('250 2.1.0 OK')
+
+    async def smtp_rcpt(self, arg):
+        if self.mail_from is None:
+            self.push('503 5.5.1 Need MAIL command')
+            return
+        if len(self.rcpt_to) >= self._limits.max_recipients:
+            self.push('452 4.5.3 Too many recipients')
+            return
+        address = _parse_path(arg, 'TO:')[0]
+        if not address:
+            self.push('501 5.5.4 Syntax: RCPT TO:<address>')
+            return
+        self.rcpt_to.append(address)
+        self.push('250 2.1.5 OK')
+
+    async def smtp_data(self, arg):
+        if not self.rcpt_to:
+            self.push('503 5.5.1 Need RCPT command')
+            return
+        if self._chunks is not None:
+            self.push('503 5.5.1 DATA is not allowed after BDAT')
+            return
+        self.push('354 End data with <CR><LF>.<CR><LF>')
+        await self._flush()
+        spool = self._server.create_spool()
+        oversized = False
+        line_start = True
+        try:
+            while True:
+                line = await self._read_data_line()
+                if line_start and line == b'.' + CRLF:
+                    break
+                if line_start and line.startswith(b'.'):
+                    line = line[1:]
+                line_start = line.endswith(CRLF)
+                if oversized or spool.size + len(line) > self._limits.max_message_size:
+                    oversized = True
+                    continue
+                spool.write(line)
+            if oversized:
+                self.push('552 5.3.4 Message size exceeds fixed limit')
+                self._server.stats['rejected'] += 1
+                SMTP_MESSAGES.labels('oversized').inc()
+            else:
+                self.push(await self._server.deliver(self.mail_from, self.rcpt_to, spool))
+                self._messages += 1
+        finally:
+            spool.close()
+        self._reset()
+
+    async def smtp_bdat(self, arg):
+        size, _, last = arg.partition(' ')
+        last = last.strip().upper()
+        if not size.isdigit() or last not in ('', 'LAST'):
+            self.push('501 5.5.4 Syntax: BDAT chunk-size [LAST]')
+            return
+        size = int(size)
+        if not self.rcpt_to:
+            # chunk is sent without waiting for reply, so it has to be consumed anyway
+            await self._read_chunk(size, None)
+            self.push('503 5.5.1 Need RCPT command')
+            return
+        if self._chunks is None:
+            self._chunks = self._server.create_spool()
+        spool = self._chunks
+        if spool.size + size > self._limits.max_message_size:
+            await self._read_chunk(size, None)
+            self.push('552 5.3.4 Message size exceeds fixed limit')
+            self._server.stats['rejected'] += 1
+            SMTP_MESSAGES.labels('oversized').inc()
+            self._reset()
+            return
+        await self._read_chunk(size, spool)
+        if not last:
+            self.push('250 2.0.0 %d octets received' % size)
+            return
+        self.push(await self._server.deliver(self.mail_from, self.rcpt_to, spool))
+        self._messages += 1
+        self._reset()
+
+    async def smtp_rset(self, arg):
+        self._reset()
+        self.push('250 2.0.0 OK')
+
+    async def smtp_noop(self, arg):
+        self.push('250 2.0.0 OK')
+
+    async def smtp_vrfy(self, arg):
+        self.push('252 2.0.0 Cannot VRFY user, but will accept message')
+
+    async def smtp_quit(self, arg):
+        self.push('221 2.0.0 Bye')
+        raise _CloseSession()
+
+
+def _parse_path(arg, prefix):
+    """
+    :return: (address, [(upper case parameter name, value or None)]), address is None on syntax error
+    :rtype: tuple
+    """
+    if not arg.upper().startswith(prefix):
+        return None, []
+    path = arg[len(prefix):].strip()
+    if path.startswith('<'):
+        end = path.find('>')
+        if end < 0:
+            return None, []
+        address, rest = path[1:end], path[end + 1:]
+    else:
+        address, _, rest = path.partition(' ')
+    params = []
+    for param in rest.split():
+        name, equals, value = param.partition('=')
+        params.append((name.upper(), value if equals else None))
+    return address, params
+
+
+class DummyServer(object):
+    """
+    SMTP listener running on single asyncio event loop. Each accepted DATA payload is
+    handed to router.Router.on_receive in executor, so slow routes do not block the loop.
+    """
+
+    def __init__(self, router, host='127.0.0.1', port=2525, limits=None, hostname=None,
+                 executor=None, reuse_port=False, spool_threshold=1024 * 1024, spool_dir=None):
+        """
+        :param router: router receiving messages
+        :type router: router.router.Router
+        :param limits: per connection limits
+        :type limits: ConnectionLimits
+        :param executor: executor running Router.on_receive, thread pool is created if none is provided
+        :param reuse_port: bind listening socket with SO_REUSEPORT
+        :param spool_threshold: size in bytes after which DATA payload is spooled to disk
+        :param spool_dir: directory for spooled payloads
+        """
+        self._router = router
+        self._host = host
+        self._port = port
+        self._reuse_port = reuse_port
+        self._spool_threshold = spool_threshold
+        self._spool_dir = spool_dir
+        self._executor = executor or ThreadPoolExecutor(max_workers=32)
+        self._server = None
+        self._slots = None
+        self.limits = limits or ConnectionLimits()
+        self.hostname = hostname or socket.getfqdn()
+        self.stats = {'connections': 0, 'active': 0, 'messages': 0, 'bytes': 0, 'rejected': 0, 'deferred': 0,
+                      'failed': 0}
+
+    def extensions(self):
+        """
+        :return: EHLO keywords of supported service extensions
+        :rtype: tuple<str>
+        """
+        return 'PIPELINING', '8BITMIME', 'CHUNKING', 'SIZE %d' % self.limits.max_message_size
+
+    def create_spool(self):
+        """:rtype: core.spool.MessageSpool"""
+        return MessageSpool(self._spool_threshold, self._spool_dir)
+
+    async def start(self):
+        self._slots = asyncio.Semaphore(self.limits.max_connections)
+        self._server = await asyncio.start_server(
+            self._on_connection, self._host, self._port,
+            limit=max(self.limits.max_line_length, 64 * 1024),
+            reuse_address=True, reuse_port=self._reuse_port or None)
+        return self._server
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def run(self):
+        """Run listener on new event loop until interrupted."""
+        try:
+            asyncio.run(self.serve_forever())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+
+    async def _on_connection(self, reader, writer):
+        self.stats['connections'] += 1
+        if self._slots.locked():
+            writer.write(b'421 4.3.2 Too many connections, try again later' + CRLF)
+            self.stats['rejected'] += 1
+            SMTP_CONNECTIONS.labels('rejected').inc()
+            writer.close()
+            return
+        async with self._slots:
+            self.stats['active'] += 1
+            SMTP_CONNECTIONS.labels('accepted').inc()
+            SMTP_ACTIVE.inc()
+            try:
+                await SMTPSession(self, reader, writer).handle()
+            finally:
+                self.stats['active'] -= 1
+                SMTP_ACTIVE.dec()
+
+    async def deliver(self, mail_from, rcpt_to, spool):
+        """
+        Hand message over to router, it is routed to envelope recipients.
+        :type spool: core.spool.MessageSpool
+        :return: SMTP reply for finished DATA command
+        :rtype: str
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            with SMTP_DELIVER_SECONDS.time():
+                await loop.run_in_executor(self._executor, self._router.on_receive, spool, mail_from,
+                                           tuple(rcpt_to))
+        except NoRouteException:
+            self.stats['rejected'] += 1
+            SMTP_MESSAGES.labels('unrouted').inc()
+            return '550 5.1.1 No route for recipient'
+        except PipelineFull:
+            self.stats['deferred'] += 1
+            SMTP_MESSAGES.labels('deferred').inc()
+            return '451 4.3.1 Insufficient system resources, try again later'
+        except DeliveryException:
+            self.stats['failed'] += 1
+            SMTP_MESSAGES.labels('failed').inc()
+            return '451 4.3.0 Message was not stored, try again later'
+        except Exception:
+            self.stats['failed'] += 1
+            SMTP_MESSAGES.labels('failed').inc()
+            return '451 4.3.0 Error processing message'
+        self.stats['messages'] += 1
+        self.stats['bytes'] += spool.size
+        SMTP_MESSAGES.labels('queued').inc()
+        SMTP_BYTES.inc(spool.size)
+        return '250 2.0.0 OK: queued'
@@ -0,0 +1,119 @@
+"""Spooled buffer for received DATA payloads."""
+import io
+import logging
+import mmap
+import threading
+from tempfile import TemporaryFile
+
+
+logger = logging.getLogger(__name__)
+
+
+class MessageSpool(object):
+    """
+    Raw message source. Small messages are held in memory, once the payload passes threshold
+    it is rolled over to temporary file on disk.
+    """
+
+    def __init__(self, threshold=1024 * 1024, directory=None):
+        """
+        :param threshold: size in bytes after which payload is written to disk
+        :param directory: directory for temporary files, system default if none
+        """
+        self._threshold = threshold
+        self._directory = directory
+        self._file = io.BytesIO()
+        self._rolled = False
+        self._size = 0
+        self._map = None
+        self._refs = 1
+        self._lock = threading.Lock()
+
+    def write(self, chunk):
+        if not self._rolled and self._size + len(chunk) > self._threshold:
+            self._rollover()
+        self._file.write(chunk)
+        self._size += len(chunk)
+
+    def _rollover(self):
+        file_ = TemporaryFile(dir=self._directory)
+        buffer_ = self._file.getbuffer()
+        try:
+            file_.write(buffer_)
+        finally:
+            buffer_.release()
+        self._file.close()
+        self._file = file_
+        self._rolled = True
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def rolled(self):
+        """:return: True if payload was written to disk"""
+        return self._rolled
+
+    def open(self):
+        """
+        :return: binary file object positioned at start of message
+        """
+        self._file.flush()
+        self._file.seek(0)
+        return self._file
+
+    def view(self):
+        """
+        Zero copy view over whole payload, memoryview of in memory buffer or mmap of spooled file.
+        :rtype: memoryview
+        """
+        self._file.flush()
+        if not self._rolled:
+            return self._file.getbuffer()
+        if self._size == 0:
+            return memoryview(b'')
+        if self._map is None:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._map)
+
+    def getvalue(self):
+        """
+        :return: copy of whole payload
+        :rtype: bytes
+        """
+        return bytes(self.view())
+
+    def retain(self):
+        """Keep payload alive for one more close call, used when message outlives SMTP session."""
+        with self._lock:
+            self._refs += 1
+
+    def release(self):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # mapping is released with views, they should have been dropped before close
+                logger.warning('Message spool of %d bytes closed while views of its mapping are alive', self._size)
+            self._map = None
+        try:
+            self._file.close()
+        except BufferError:
+            logger.warning('Message spool of %d bytes closed while views of its buffer are alive', self._size)
+
+    def __len__(self):
+        return self._size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
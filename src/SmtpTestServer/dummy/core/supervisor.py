@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""Multi process SMTP ingest, workers share listening port through SO_REUSEPORT."""
+import asyncio
+import multiprocessing
+import queue
+import signal
+import time
+
+from core.server import DummyServer
+from router.router import Router
+
+
+# gauges are not summed over retired (dead) workers
+_GAUGES = ('active',)
+
+
+def _worker(index, selector_factory, server_kwargs, report_queue, report_interval):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    router = Router(selector_factory())
+    server = DummyServer(router, reuse_port=True, **server_kwargs)
+
+    async def report():
+        while True:
+            await asyncio.sleep(report_interval)
+            report_queue.put((index, dict(server.stats)))
+
+    async def main():
+        await server.start()
+        reporter = asyncio.ensure_future(report())
+        try:
+            await server.serve_forever()
+        finally:
+            reporter.cancel()
+
+    asyncio.run(main())
+
+
+class Supervisor(object):
+    """
+    Forks workers, each running own DummyServer loop and Router. Dead workers are restarted
+    and counters of all workers (running and dead ones) are summed.
+    """
+
+    def __init__(self, selector_factory, workers=None, report_interval=1.0, **server_kwargs):
+        """
+        :param selector_factory: callable creating router.router.RouteSelector in worker process
+        :param workers: count of worker processes, defaults to cpu count
+        :param report_interval: seconds between workers stats reports
+        :param server_kwargs: keyword arguments passed to core.server.DummyServer
+        """
+        self._selector_factory = selector_factory
+        self._workers_count = workers or multiprocessing.cpu_count()
+        self._report_interval = report_interval
+        self._server_kwargs = server_kwargs
+        self._context = multiprocessing.get_context('fork')
+        self._queue = self._context.Queue()
+        self._workers = {}
+        self._latest = {}
+        self._retired = {}
+        self._running = False
+        self.restarts = 0
+
+    def _spawn(self, index):
+        process = self._context.Process(
+            target=_worker, name='smtp-worker-%d' % index,
+            args=(index, self._selector_factory, self._server_kwargs, self._queue, self._report_interval))
+        process.daemon = True
+        process.start()
+        self._workers[index] = process
+
+    def _retire(self, index):
+        for name, value in self._latest.pop(index, {}).items():
+            if name not in _GAUGES:
+                self._retired[name] = self._retired.get(name, 0) + value
+
+    def _collect(self, timeout):
+        try:
+            while True:
+                index, stats = self._queue.get(timeout=timeout)
+                self._latest[index] = stats
+                timeout = 0
+        except queue.Empty:
+            pass
+
+    def totals(self):
+        """
+        :return: counters summed over all workers
+        :rtype: dict
+        """
+        totals = dict(self._retired)
+        for stats in self._latest.values():
+            for name, value in stats.items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def check(self):
+        """Restart dead workers."""
+        if not self._running:
+            return
+        for index, process in list(self._workers.items()):
+            if not process.is_alive():
+                process.join()
+                self._retire(index)
+                self.restarts += 1
+                self._spawn(index)
+
+    def start(self):
+        self._running = True
+        for index in range(self._workers_count):
+            self._spawn(index)
+
+    def stop(self):
+        self._running = False
+        for process in self._workers.values():
+            process.terminate()
+        for process in self._workers.values():
+            process.join()
+        self._collect(0)
+
+    def run(self, on_report=None):
+        """
+        Supervise workers until interrupted.
+        :param on_report: callable receiving summed counters every report interval
+        """
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, '_running', False))
+        self.start()
+        try:
+            while self._running:
+                deadline = time.time() + self._report_interval
+                self._collect(self._report_interval)
+                self.check()
+                if on_report is not None:
+                    on_report(self.totals())
+                time.sleep(max(0, deadline - time.time()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
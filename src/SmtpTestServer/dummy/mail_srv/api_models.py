@@ -1,6 +1,25 @@
+from api.constraints import Constraint
 from api.models import ApiModel, SimpleProperty, DateTimeProperty, ListOfModelsProperty
 
 
+def _is_header_value(value):
+    return type(value) is str and '\r' not in value and '\n' not in value
+
+
+class HeaderValue(Constraint):
+    """String usable as header value, without line breaks."""
+
+    def is_valid(self, value):
+        return value is None or _is_header_value(value)
+
+
+class AddressList(Constraint):
+    """List of non empty address strings usable in headers."""
+
+    def is_valid(self, value):
+        return value is None or all(_is_header_value(item) and item for item in value)
+
+
 class MessagePart(ApiModel):
     id = SimpleProperty(int)
     part_type = SimpleProperty(str)
@@ -21,3 +40,15 @@ class Message(ApiModel):
     size = SimpleProperty(int)
     recipients = SimpleProperty(dict)
     parts = ListOfModelsProperty(MessagePart)
+
+
+class OutgoingMessage(ApiModel):
+    from_ = SimpleProperty(str, name='from', nullable=False, constraints=(HeaderValue(),))
+    to = SimpleProperty(list, nullable=False, constraints=(AddressList(),))
+    cc = SimpleProperty(list, empty=True, constraints=(AddressList(),))
+    subject = SimpleProperty(str, empty=True, constraints=(HeaderValue(),))
+    body = SimpleProperty(str, empty=True)
+    html = SimpleProperty(str, empty=True)
+
+    # optional properties of /send/ payload
+    DEFAULTS = {'cc': None, 'subject': '', 'body': '', 'html': None}
@@ -0,0 +1,90 @@
+"""Content addressed storage of message part bodies."""
+import hashlib
+from collections import OrderedDict
+
+from sqlalchemy import bindparam, func, select
+
+from mail_srv.models import Blob, MessagePart
+
+
+def content_hash(body):
+    """
+    :rtype: str
+    """
+    return hashlib.sha256(body).hexdigest()
+
+
+class BlobStore(object):
+    """
+    Part bodies are stored once per distinct content in blob table, message parts reference
+    them by hash. Blob refs count referencing parts, blobs without references are removed by collect.
+    """
+
+    def __init__(self):
+        blob = Blob.__table__
+        self._table = blob
+        self._insert = blob.insert()
+        self._incref = blob.update().where(blob.c.hash == bindparam('_hash')).values(
+            refs=blob.c.refs + bindparam('_count'))
+
+    def store(self, connection, bodies):
+        """
+        Store bodies, which are not stored yet and increment references of all of them.
+        :param bodies: part bodies
+        :type bodies: list<bytes>
+        :return: hashes of bodies in the same order
+        :rtype: list<str>
+        """
+        hashes = []
+        counts = OrderedDict()
+        unique = {}
+        for body in bodies:
+            hash_ = content_hash(body)
+            hashes.append(hash_)
+            counts[hash_] = counts.get(hash_, 0) + 1
+            unique[hash_] = body
+        if not counts:
+            return hashes
+        existing = set(row[0] for row in connection.execute(
+            select(self._table.c.hash).where(self._table.c.hash.in_(list(counts)))))
+        new_rows = [{'hash': hash_, 'body': unique[hash_], 'size': len(unique[hash_]), 'refs': count}
+                    for hash_, count in counts.items() if hash_ not in existing]
+        if new_rows:
+            connection.execute(self._insert, new_rows)
+        updates = [{'_hash': hash_, '_count': count} for hash_, count in counts.items() if hash_ in existing]
+        if updates:
+            connection.execute(self._incref, updates)
+        return hashes
+
+    def load(self, connection, hash_):
+        """
+        :rtype: bytes
+        """
+        return connection.execute(select(self._table.c.body).where(self._table.c.hash == hash_)).scalar()
+
+    def release(self, connection, message_ids):
+        """
+        Delete parts of messages and decrement references of their blobs.
+        :type message_ids: list<int>
+        """
+        part = MessagePart.__table__
+        rows = connection.execute(
+            select(part.c.blob_hash, func.count()).where(part.c.message_id.in_(message_ids))
+            .where(part.c.blob_hash.isnot(None)).group_by(part.c.blob_hash)).fetchall()
+        connection.execute(part.delete().where(part.c.message_id.in_(message_ids)))
+        if rows:
+            connection.execute(self._incref, [{'_hash': hash_, '_count': -count} for hash_, count in rows])
+
+    def collect(self, connection, recount=False):
+        """
+        Remove orphaned blobs.
+        :param recount: recompute references from message parts before removal
+        :return: count of removed blobs
+        :rtype: int
+        """
+        blob = self._table
+        part = MessagePart.__table__
+        if recount:
+            refs = select(func.count()).where(part.c.blob_hash == blob.c.hash).scalar_subquery()
+            connection.execute(blob.update().values(refs=refs))
+        return connection.execute(blob.delete().where(blob.c.refs <= 0)).rowcount
@@ -0,0 +1,115 @@
+"""Downloadable message sources and part bodies, read in chunks without loading whole value."""
+import sqlite3
+
+from abc import ABCMeta, abstractmethod
+from sqlalchemy import bindparam, func, select
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+class Content(object):
+    """Immutable bytes with known size and entity tag, served by download endpoints."""
+    __metaclass__ = ABCMeta
+
+    def __init__(self, size, etag, content_type, file_name=None):
+        """
+        :param etag: quoted entity tag, content never changes for the same tag
+        """
+        self.size = size
+        self.etag = etag
+        self.content_type = content_type
+        self.file_name = file_name
+
+    @abstractmethod
+    def chunks(self, start=0, end=None, chunk_size=CHUNK_SIZE):
+        """
+        :param end: exclusive end offset, size if none
+        :return: generator of bytes-like chunks of range
+        """
+        pass
+
+
+class BytesContent(Content):
+    """Content already in memory, chunks are views of it."""
+
+    def __init__(self, body, etag, content_type, file_name=None):
+        super(BytesContent, self).__init__(len(body), etag, content_type, file_name)
+        self._view = memoryview(body)
+
+    def chunks(self, start=0, end=None, chunk_size=CHUNK_SIZE):
+        end = self.size if end is None else end
+        for offset in range(start, end, chunk_size):
+            yield self._view[offset:min(offset + chunk_size, end)]
+
+
+class ColumnContent(Content):
+    """Binary column of one row, read by substr of chunk size."""
+
+    def __init__(self, engine, column, key_column, key, size, etag, content_type, file_name=None):
+        super(ColumnContent, self).__init__(size, etag, content_type, file_name)
+        self._engine = engine
+        self._column = column
+        self._key_column = key_column
+        self._key = key
+
+    def chunks(self, start=0, end=None, chunk_size=CHUNK_SIZE):
+        end = self.size if end is None else end
+        query = select(func.substr(self._column, bindparam('_start'), bindparam('_length')))\
+            .where(self._key_column == self._key)
+        with self._engine.connect() as connection:
+            for offset in range(start, end, chunk_size):
+                # substr offsets start at 1
+                yield connection.execute(query, {'_start': offset + 1, '_length': min(chunk_size, end - offset)})\
+                    .scalar()
+
+
+class SqliteBlobContent(ColumnContent):
+    """Binary column read through SQLite incremental blob I/O, value is never loaded as a whole."""
+
+    @staticmethod
+    def available(engine):
+        return engine.dialect.name == 'sqlite' and hasattr(sqlite3.Connection, 'blobopen')
+
+    def chunks(self, start=0, end=None, chunk_size=CHUNK_SIZE):
+        end = self.size if end is None else end
+        table = self._column.table
+        connection = self._engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute('SELECT rowid FROM %s WHERE %s = ?' % (table.name, self._key_column.name), (self._key,))
+            row = cursor.fetchone()
+            cursor.close()
+            if row is None:
+                return
+            blob = connection.driver_connection.blobopen(table.name, self._column.name, row[0], readonly=True)
+            try:
+                blob.seek(start)
+                offset = start
+                while offset < end:
+                    chunk = blob.read(min(chunk_size, end - offset))
+                    if not chunk:
+                        break
+                    offset += len(chunk)
+                    yield chunk
+            finally:
+                blob.close()
+        finally:
+            connection.close()
+
+
+def column_content(engine, column, key_column, key, size, etag, content_type, file_name=None):
+    """
+    :return: content of binary column in row selected by key, read with incremental blob I/O on SQLite
+    :rtype: Content
+    """
+    content_class = SqliteBlobContent if SqliteBlobContent.available(engine) else ColumnContent
+    return content_class(engine, column, key_column, key, size, etag, content_type, file_name)
+
+
+def part_content_type(part_type, charset):
+    """:rtype: str"""
+    content_type = part_type or 'application/octet-stream'
+    if charset and content_type.startswith('text/'):
+        content_type = '%s; charset=%s' % (content_type, charset)
+    return content_type
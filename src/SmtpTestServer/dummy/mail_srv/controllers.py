@@ -1,45 +1,250 @@
 # """Base module with controllers"""
+import binascii
 import json
-from StringIO import StringIO
+import threading
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from urllib.parse import quote
 
-from models import Message
-from settings import app, Session
+import metrics
+from api.encoders import stream_array
+from api.marshallers import REGISTRY as MARSHALLERS
+from api.models import ValidationError
+from mail_srv.api_models import OutgoingMessage
+from mail_srv.notify import get_notifier
+from mail_srv.relay import create_email, get_relay
+from mail_srv.storage import get_storage
+from settings import app
 
-from flask import request
+from flask import g, request
+
+
+DEFAULT_WAIT_TIMEOUT = 30.0
+MAX_WAIT_TIMEOUT = 300.0
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+CURSOR_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+HTTP_REQUEST_SECONDS = metrics.histogram('http_request_seconds', 'Duration of API handlers, streamed bodies '
+                                         'are not included', ('endpoint', 'method'))
+HTTP_RESPONSES = metrics.counter('http_responses_total', 'API responses by status', ('endpoint', 'status'))
+MARSHALLER_MEMO = metrics.counter('marshaller_memo_conversions_total', 'Conversions of memoizing marshallers',
+                                  ('marshaller', 'result'))
+_MARSHALLER_MEMO_LOCK = threading.Lock()
+
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    started = getattr(g, 'started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unknown'
+        HTTP_REQUEST_SECONDS.labels(endpoint, request.method).observe(time.perf_counter() - started)
+        HTTP_RESPONSES.labels(endpoint, str(response.status_code)).inc()
+    return response
+
+
+@app.route('/metrics')
+def export_metrics():
+    """
+    Return metrics of this process in Prometheus text format, listener metrics of supervisor
+    worker processes are not included
+    """
+    with _MARSHALLER_MEMO_LOCK:
+        # memo counts are advanced by their delta since previous export
+        for key, stats in MARSHALLERS.stats().items():
+            for result, total in (('hit', stats['hits']), ('miss', stats['misses'])):
+                counter = MARSHALLER_MEMO.labels(key, result)
+                if total > counter.value:
+                    counter.inc(total - counter.value)
+    return app.response_class(metrics.REGISTRY.render(), status=200,
+                              content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 @app.route('/inbox/')
 def list_messages():
-    """Return list of recieved mail messages"""
-    session = Session()
-    messages = session.query(Message).all()
-    msg_lst = []
-    for message in messages:
-        msg_lst.append(create_message(message))
-    return msg_lst
+    """
+    Return page of recieved mail messages, newest first.
+    Query arguments: limit, cursor (from X-Next-Cursor header of previous page), mailbox, sender, subject
+    """
+    try:
+        limit = page_limit()
+        cursor = decode_cursor(request.args.get('cursor'))
+        mailbox = request.args.get('mailbox')
+        mailbox = int(mailbox) if mailbox is not None else None
+    except ValueError:
+        return {'error': 'Invalid query argument'}, 400
+    messages = get_storage().list_messages(limit, cursor, mailbox, request.args.get('sender'),
+                                           request.args.get('subject'))
+    headers = {}
+    if len(messages) == limit:
+        headers['X-Next-Cursor'] = encode_cursor(messages[-1])
+    # array is encoded while it is sent, dicts of whole page are never built at once
+    return app.response_class(stream_array(create_message(message) for message in messages), status=200,
+                              headers=headers, mimetype='application/json')
+
+
+@app.route('/inbox/wait')
+def wait_message():
+    """
+    Long poll for message matching filters, returns already stored match immediately.
+    Query arguments: recipient, sender, subject (substring), after (message id), timeout (seconds)
+    """
+    filters = dict((name, request.args[name]) for name in ('recipient', 'sender', 'subject') if name in request.args)
+    try:
+        timeout = min(float(request.args.get('timeout', DEFAULT_WAIT_TIMEOUT)), MAX_WAIT_TIMEOUT)
+        filters['after'] = int(request.args.get('after', 0))
+    except ValueError:
+        return {'error': 'Invalid query argument'}, 400
+    notifier = get_notifier()
+    # messages published after this point are caught by notifier, older ones by storage
+    since = notifier.sequence
+    message = get_storage().find_message(**filters)
+    if message is not None:
+        return create_message(message)
+    summary = notifier.wait(since, timeout, **filters)
+    if summary is None:
+        return '', 204
+    return create_message_from_summary(summary)
 
 
 @app.route('/inbox/<int:id>', methods=['GET'])
 def show_message(id):
     """
-    Return message selected by id
+    Return message selected by id with descriptions of its parts
     """
-    session = Session()
-    message = session.query(Message).filter_by(id=id).one()
+    found = get_storage().get_message(id)
+    if found is None:
+        return {'error': 'Message not found'}, 404
+    message, recipients, parts = found
     msg_dct = create_message(message)
     msg_dct["size"] = message.size
-    msg_dct["recipients"] = create_recipients(message.recipients)
+    msg_dct["recipients"] = create_recipients(recipients)
+    msg_dct["parts"] = create_parts(parts)
     return msg_dct
 
 
+@app.route('/inbox/<int:id>/source', methods=['GET'])
+def message_source(id):
+    """
+    Return raw message source, supports Range and If-None-Match requests
+    """
+    content = get_storage().get_source(id)
+    if content is None:
+        return {'error': 'Message not found'}, 404
+    return send_content(content)
+
+
+@app.route('/inbox/<int:id>/parts/<int:part_id>', methods=['GET'])
+def message_part(id, part_id):
+    """
+    Return body of message part, supports Range and If-None-Match requests
+    """
+    content = get_storage().get_part(id, part_id)
+    if content is None:
+        return {'error': 'Part not found'}, 404
+    return send_content(content)
+
+
+@app.route('/search')
+def search_messages():
+    """
+    Return messages matching all tokens of query, best ranked first.
+    Query arguments: q, limit, offset (from X-Next-Offset header of previous page)
+    """
+    query = request.args.get('q', '')
+    try:
+        limit = page_limit()
+        offset = int(request.args.get('offset', 0))
+        if offset < 0:
+            raise ValueError('Offset has to be non negative')
+    except ValueError:
+        return {'error': 'Invalid query argument'}, 400
+    messages = get_storage().search(query, limit, offset)
+    msg_lst = [create_message(message) for message in messages]
+    headers = {}
+    if len(messages) == limit:
+        headers['X-Next-Offset'] = str(offset + limit)
+    return msg_lst, 200, headers
+
+
 @app.route('/send/', methods=['POST'])
 def send_message():
-    # session = Session()
-    post_data = request.data
-    message_data = json.loads(post_data)
+    """
+    Queue message or list of messages to outbound relay, returns job id immediately.
+    Message keys: from, to (list), cc (list), subject, body, html
+    """
+    try:
+        message_data = json.loads(request.get_data())
+    except ValueError:
+        return {'error': 'Invalid json'}, 400
+    batch = message_data if type(message_data) is list else [message_data]
+    if not batch or not all(type(item) is dict for item in batch):
+        return {'error': 'Expected message object or list of message objects'}, 400
+    try:
+        messages = OutgoingMessage.load_batch([dict(OutgoingMessage.DEFAULTS, **item) for item in batch])
+    except ValidationError as e:
+        return {'error': 'Invalid messages', 'rows': e.rows, 'fields': e.errors}, 400
+    job = get_relay().submit([(message.from_, list(message.to) + list(message.cc or ()), create_email(message))
+                              for message in messages])
+    return {'job': job.id, 'status': '/send/%s' % job.id}, 202, {'Location': '/send/%s' % job.id}
+
+
+@app.route('/send/<job_id>', methods=['GET'])
+def send_status(job_id):
+    """
+    Return progress of job queued by /send/
+    """
+    job = get_relay().job(job_id)
+    if job is None:
+        return {'error': 'Job not found'}, 404
+    return job.status()
 
 
 
+def send_content(content):
+    """
+    Create streamed response of content, only requested range is read from storage.
+    :type content: mail_srv.content.Content
+    """
+    headers = {'ETag': content.etag, 'Accept-Ranges': 'bytes', 'Cache-Control': 'private, max-age=31536000, immutable'}
+    if content.file_name:
+        headers['Content-Disposition'] = content_disposition(content.file_name)
+    if request.if_none_match.contains_raw(content.etag):
+        return app.response_class(None, status=304, headers=headers)
+    start, end, status = 0, content.size, 200
+    byte_range, if_range = request.range, request.if_range
+    # range of stale If-Range is ignored and whole content is sent, there is no Last-Modified to match dates
+    stale = (if_range.etag or if_range.date) and if_range.etag != content.etag.strip('"')
+    # multiple ranges are not supported, whole content is sent instead
+    if byte_range is not None and len(byte_range.ranges) == 1 and not stale:
+        bounds = byte_range.range_for_length(content.size)
+        if bounds is None:
+            headers['Content-Range'] = 'bytes */%d' % content.size
+            return app.response_class(None, status=416, headers=headers)
+        start, end = bounds
+        status = 206
+        headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end - 1, content.size)
+    headers['Content-Length'] = str(end - start)
+    return app.response_class(content.chunks(start, end), status=status, headers=headers,
+                              content_type=content.content_type, direct_passthrough=True)
+
+
+def content_disposition(file_name):
+    """
+    :param file_name: file name of part, taken from message as is
+    :return: attachment disposition with printable ASCII fallback and RFC 5987 encoded name
+    :rtype: str
+    """
+    fallback = ''.join(char if ' ' <= char < '\x7f' and char not in '"\\' else '_' for char in file_name)
+    return 'attachment; filename="%s"; filename*=UTF-8\'\'%s' % (fallback, quote(file_name, safe=''))
+
+
 def create_message(message):
     """
     Create json message object, based on model.
@@ -57,19 +262,74 @@ def create_message(message):
     }
 
 
+def create_message_from_summary(summary):
+    """
+    Create json message object from summary published by mail_srv.notify.MessageNotifier.
+    :rtype: dict
+    """
+    return {
+        "id": summary['id'],
+        "from": summary['sender'],
+        "preview": summary['preview'] or '',
+        "subject": summary['subject'],
+        "date": summary['date_created'],
+    }
+
+
+def page_limit():
+    """
+    :return: limit query argument clamped to MAX_PAGE_SIZE
+    :raise ValueError: limit is not positive integer
+    """
+    limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    if limit < 1:
+        raise ValueError('Limit has to be positive')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def encode_cursor(message):
+    """
+    Create opaque keyset cursor pointing after message.
+    :rtype: str
+    """
+    key = '%s|%d' % (message.date_created.strftime(CURSOR_DATE_FORMAT), message.id)
+    return urlsafe_b64encode(key.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    :return: (date_created, id) of last message on previous page, None for first page
+    :rtype: tuple|None
+    """
+    if not cursor:
+        return None
+    try:
+        date_created, id_ = urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split('|')
+    except (TypeError, UnicodeError, binascii.Error):
+        raise ValueError('Invalid cursor')
+    return datetime.strptime(date_created, CURSOR_DATE_FORMAT), int(id_)
+
+
+def create_parts(part_list):
+    """
+    Create part descriptions, ids select /inbox/<id>/parts/<part_id> bodies
+    :arg part_list: (id, part_type, file_name, size) rows
+    :rtype: list<dict>
+    """
+    return [{'id': id_, 'part_type': part_type, 'file_name': file_name, 'size': size}
+            for id_, part_type, file_name, size in part_list]
+
+
 def create_recipients(rcp_list):
     """
-    Create recipient mailaddresses from string
-    :return: list of recipients
-    :rtype: list
-    """
-    out_addrs = {}
-    addresses = json.load(StringIO(rcp_list))
-    headers = ('to', 'cc', 'bcc')
-    for header in headers:
-        out_addrs[header] = []
-        for name, email in addresses[header]:
-            out_addrs[header].append((name, email))
+    Create recipient mailaddresses from message_recipient rows
+    :arg rcp_list: (kind, name, email) rows
+    :return: recipients by header
+    :rtype: dict
+    """
+    out_addrs = {'to': [], 'cc': [], 'bcc': []}
+    for kind, name, email in rcp_list:
+        out_addrs[kind].append((name, email))
     return out_addrs
 
 
@@ -78,6 +338,7 @@ def create_preview(message):
     Create preview of message
     :arg message: database model
     :type: models.Message
-    :return: Return message preview as string
+    :return: Return message preview as string, preview is computed on ingest
     :rtype: str
     """
+    return message.preview or ''
@@ -0,0 +1,188 @@
+"""Versioned schema migrations of mail server database."""
+import json
+
+from sqlalchemy import Column, Integer, MetaData, Table, func, inspect, select
+
+from mail_srv.models import Blob, Message, MessagePart, MessageRecipient
+from mail_srv.search import Fts5Index, fts5_supported
+from mail_srv.writer import create_search_document
+from settings import Base
+
+
+_metadata = MetaData()
+
+schema_version = Table('schema_version', _metadata, Column('version', Integer, nullable=False))
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register function migrating schema from version - 1 to version."""
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return fn
+    return register
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(connection):
+    """
+    :return: schema version, 0 for database without version table
+    :rtype: int
+    """
+    if not inspect(connection).has_table(schema_version.name):
+        return 0
+    return connection.execute(select(schema_version.c.version)).scalar() or 0
+
+
+def _stamp(connection, version):
+    schema_version.create(connection, checkfirst=True)
+    connection.execute(schema_version.delete())
+    connection.execute(schema_version.insert(), {'version': version})
+
+
+def create_schema(engine):
+    """Create all tables of fresh database at latest version."""
+    with engine.begin() as connection:
+        Base.metadata.create_all(connection)
+        if fts5_supported(connection):
+            _create_message_fts(connection)
+        _stamp(connection, latest_version())
+
+
+def migrate(engine, target=None):
+    """
+    Apply pending migrations, each one in own transaction.
+    :param target: version to migrate to, latest if none
+    :return: list of applied versions
+    :rtype: list<int>
+    """
+    target = latest_version() if target is None else target
+    applied = []
+    with engine.connect() as connection:
+        version = current_version(connection)
+    for number, description, fn in MIGRATIONS:
+        if number <= version or number > target:
+            continue
+        with engine.begin() as connection:
+            fn(connection)
+            _stamp(connection, number)
+        applied.append(number)
+    return applied
+
+
+def _columns(connection, table_name):
+    return set(column['name'] for column in inspect(connection).get_columns(table_name))
+
+
+def _create_indexes(connection, table):
+    existing = set(index['name'] for index in inspect(connection).get_indexes(table.name))
+    for index in table.indexes:
+        if index.name not in existing:
+            index.create(connection)
+
+
+def _create_message_fts(connection):
+    connection.exec_driver_sql('CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(subject, sender, recipients, body)'
+                               % Fts5Index.TABLE)
+
+
+def _rebuild_sqlite_table(connection, table):
+    """SQLite can not add constraints to existing table, table is recreated and rows are copied."""
+    old_name = '_%s_old' % table.name
+    columns = _columns(connection, table.name)
+    connection.exec_driver_sql('ALTER TABLE %s RENAME TO %s' % (table.name, old_name))
+    for index in inspect(connection).get_indexes(old_name):
+        connection.exec_driver_sql('DROP INDEX %s' % index['name'])
+    table.create(connection)
+    names = ', '.join(column.name for column in table.columns if column.name in columns)
+    connection.exec_driver_sql('INSERT INTO %s (%s) SELECT %s FROM %s' % (table.name, names, names, old_name))
+    connection.exec_driver_sql('DROP TABLE %s' % old_name)
+
+
+@migration(1, 'message uid, blob table and message_part.blob_hash')
+def _add_blob_storage(connection):
+    if 'uid' not in _columns(connection, Message.__tablename__):
+        connection.exec_driver_sql('ALTER TABLE message ADD COLUMN uid VARCHAR(32)')
+        connection.exec_driver_sql('CREATE UNIQUE INDEX uq_message_uid ON message (uid)')
+    Blob.__table__.create(connection, checkfirst=True)
+    if 'blob_hash' not in _columns(connection, MessagePart.__tablename__):
+        connection.exec_driver_sql('ALTER TABLE message_part ADD COLUMN blob_hash VARCHAR(64)')
+
+
+@migration(2, 'message_part foreign keys and indexes of inbox queries')
+def _add_inbox_indexes(connection):
+    part = MessagePart.__table__
+    if connection.dialect.name == 'sqlite':
+        _rebuild_sqlite_table(connection, part)
+    else:
+        connection.exec_driver_sql('ALTER TABLE message_part ADD CONSTRAINT fk_message_part_message_id '
+                                   'FOREIGN KEY (message_id) REFERENCES message (id)')
+        connection.exec_driver_sql('ALTER TABLE message_part ADD CONSTRAINT fk_message_part_blob_hash '
+                                   'FOREIGN KEY (blob_hash) REFERENCES blob (hash)')
+        _create_indexes(connection, part)
+    _create_indexes(connection, Message.__table__)
+
+
+@migration(3, 'message preview and message_recipient table')
+def _add_preview_and_recipients(connection):
+    if 'preview' not in _columns(connection, Message.__tablename__):
+        connection.exec_driver_sql('ALTER TABLE message ADD COLUMN preview VARCHAR(255)')
+    recipient = MessageRecipient.__table__
+    recipient.create(connection, checkfirst=True)
+    message = Message.__table__
+    last_id, batch = 0, 10000
+    while True:
+        messages = connection.execute(
+            select(message.c.id, message.c.recipients).where(message.c.id > last_id)
+            .order_by(message.c.id).limit(batch)).fetchall()
+        if not messages:
+            break
+        rows = []
+        for message_id, recipients in messages:
+            for kind, addresses in json.loads(recipients or '{}').items():
+                for name, email in addresses:
+                    rows.append({'message_id': message_id, 'kind': kind, 'name': name, 'email': email})
+        if rows:
+            connection.execute(recipient.insert(), rows)
+        last_id = messages[-1][0]
+
+
+@migration(4, 'message_fts full text table of existing messages')
+def _add_message_fts(connection):
+    if not fts5_supported(connection) or inspect(connection).has_table(Fts5Index.TABLE):
+        return
+    _create_message_fts(connection)
+    index = Fts5Index(connection.engine)
+    message, part, blob = Message.__table__, MessagePart.__table__, Blob.__table__
+    recipient = MessageRecipient.__table__
+    last_id, batch = 0, 1000
+    while True:
+        messages = connection.execute(
+            select(message.c.id, message.c.subject, message.c.sender).where(message.c.id > last_id)
+            .order_by(message.c.id).limit(batch)).fetchall()
+        if not messages:
+            break
+        ids = [row[0] for row in messages]
+        parts, recipients = {}, {}
+        # legacy parts keep body inline, newer ones in blob table
+        rows = connection.execute(
+            select(part.c.message_id, part.c.part_type, part.c.is_attachement, part.c.charset,
+                   func.coalesce(blob.c.body, part.c.body).label('body'))
+            .select_from(part.outerjoin(blob, blob.c.hash == part.c.blob_hash))
+            .where(part.c.message_id.in_(ids)).order_by(part.c.id)).mappings()
+        for row in rows:
+            parts.setdefault(row['message_id'], []).append(dict(row, body=row['body'] or b''))
+        rows = connection.execute(
+            select(recipient.c.message_id, recipient.c.name, recipient.c.email)
+            .where(recipient.c.message_id.in_(ids)).order_by(recipient.c.id)).mappings()
+        for row in rows:
+            recipients.setdefault(row['message_id'], []).append(row)
+        index.add(connection, [create_search_document(id_, {'subject': subject, 'sender': sender},
+                                                      parts.get(id_, []), recipients.get(id_, []))
+                               for id_, subject, sender in messages])
+        last_id = ids[-1]
@@ -1,5 +1,5 @@
 """Base mail message models. """
-from sqlalchemy import Column, Integer, String, DateTime, LargeBinary, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, LargeBinary, ForeignKey, Index
 from settings import Base
 
 
@@ -9,14 +9,34 @@ class Message(Base):
     __tablename__ = 'message'
 
     id = Column(Integer, primary_key=True)
+    uid = Column(String(32), unique=True)
     mailbox_id = Column(Integer, ForeignKey('mailboxes.id'))
     sender = Column(String)
     recipients = Column(String)
     subject = Column(String(191))
-    source = Column(LargeBinary),
-    size = Column(Integer),
+    preview = Column(String(255))
+    source = Column(LargeBinary)
+    size = Column(Integer)
     date_created = Column(DateTime)
 
+    __table_args__ = (
+        Index('ix_message_date_created_id', 'date_created', 'id'),
+        Index('ix_message_mailbox_id_date_created', 'mailbox_id', 'date_created'),
+        Index('ix_message_sender', 'sender'),
+    )
+
+
+class MessageRecipient(Base):
+    """Recipient of message, from to, cc or bcc header."""
+
+    __tablename__ = 'message_recipient'
+
+    id = Column(Integer, primary_key=True)
+    message_id = Column(Integer, ForeignKey('message.id'), nullable=False, index=True)
+    kind = Column(String(3), nullable=False)
+    name = Column(String)
+    email = Column(String(191), index=True)
+
 
 class MessagePart(Base):
     """Message part model"""
@@ -24,17 +44,29 @@ class MessagePart(Base):
     __tablename__ = 'message_part'
 
     id = Column(Integer, primary_key=True)
-    message_id = Column(Integer, null=False)
+    message_id = Column(Integer, ForeignKey('message.id'), nullable=False, index=True)
     cid = Column(String)
     part_type = Column(String)
     is_attachement = Column(Integer)
     file_name = Column(String)
     charset = Column(String(8))
-    body = Column(LargeBinary)
+    body = Column(LargeBinary)  # legacy inline body, new parts reference blob by hash
+    blob_hash = Column(String(64), ForeignKey('blob.hash'), index=True)
     size = Column(Integer)
     created_at = Column(DateTime)
 
 
+class Blob(Base):
+    """Deduplicated part body, keyed by SHA-256 of content."""
+
+    __tablename__ = 'blob'
+
+    hash = Column(String(64), primary_key=True)
+    body = Column(LargeBinary)
+    size = Column(Integer)
+    refs = Column(Integer, nullable=False, default=0)
+
+
 class MailBox(Base):
     __tablename__ = 'mailboxes'
 
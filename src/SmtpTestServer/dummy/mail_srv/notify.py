@@ -0,0 +1,101 @@
+"""In process notification about stored messages, used by long polling endpoints."""
+import threading
+import time
+from collections import deque
+
+
+def matches(message, recipient=None, sender=None, subject=None, after=0):
+    """
+    :param message: stored message summary, as published by mail_srv.writer.BatchWriter
+    :type message: dict
+    :param subject: substring of subject
+    :param after: message id has to be greater
+    :rtype: bool
+    """
+    if message['id'] <= after:
+        return False
+    if recipient is not None and recipient not in message['recipients']:
+        return False
+    if sender is not None and message['sender'] != sender:
+        return False
+    if subject is not None and subject not in (message['subject'] or ''):
+        return False
+    return True
+
+
+class MessageNotifier(object):
+    """
+    Keeps window of recently stored messages, waiters block until message matching their filter
+    is published. Register publish as listener of mail_srv.writer.BatchWriter.
+    """
+
+    def __init__(self, history=10000):
+        """
+        :param history: count of recent messages kept for waiters which started before publish
+        """
+        self._condition = threading.Condition()
+        self._recent = deque(maxlen=history)
+        self._sequence = 0
+
+    @property
+    def sequence(self):
+        """:return: sequence number of last published message"""
+        return self._sequence
+
+    def publish(self, messages):
+        """
+        :param messages: stored message summaries
+        :type messages: list<dict>
+        """
+        with self._condition:
+            for message in messages:
+                self._sequence += 1
+                self._recent.append((self._sequence, message))
+            self._condition.notify_all()
+
+    def _find(self, since, filters):
+        """:return: oldest message published after since matching filters, only newer entries are scanned"""
+        found = None
+        for sequence, message in reversed(self._recent):
+            if sequence <= since:
+                break
+            if matches(message, **filters):
+                found = message
+        return found
+
+    def wait(self, since, timeout, **filters):
+        """
+        Block until message published after since sequence matches filters.
+        :param since: sequence number obtained before waiter checked already stored messages
+        :param timeout: seconds to wait
+        :param filters: recipient, sender, subject and after filters
+        :return: matching message summary or None on timeout
+        :rtype: dict|None
+        """
+        deadline = time.time() + timeout
+        with self._condition:
+            while True:
+                message = self._find(since, filters)
+                if message is not None:
+                    return message
+                since = self._sequence
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+
+_NOTIFIER = None
+_NOTIFIER_LOCK = threading.Lock()
+
+
+def get_notifier():
+    """
+    :return: process wide notifier
+    :rtype: MessageNotifier
+    """
+    global _NOTIFIER
+    with _NOTIFIER_LOCK:
+        if _NOTIFIER is None:
+            _NOTIFIER = MessageNotifier()
+        return _NOTIFIER
@@ -0,0 +1,320 @@
+"""Outbound SMTP relay with persistent connection pools, used by /send/ endpoint."""
+import smtplib
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from email.message import EmailMessage, Message
+
+import settings
+from core.spool import MessageSpool
+from router.message import ReceivedMessage
+from router.router import Route
+
+
+def create_email(outgoing):
+    """
+    :type outgoing: mail_srv.api_models.OutgoingMessage
+    :rtype: email.message.EmailMessage
+    """
+    email = EmailMessage()
+    email['From'] = outgoing.from_
+    email['To'] = ', '.join(outgoing.to)
+    if outgoing.cc:
+        email['Cc'] = ', '.join(outgoing.cc)
+    email['Subject'] = outgoing.subject or ''
+    email.set_content(outgoing.body or '')
+    if outgoing.html:
+        email.add_alternative(outgoing.html, subtype='html')
+    return email
+
+
+def _message_bytes(message):
+    """Copy of message source, relay sends it after router released received message."""
+    if isinstance(message, ReceivedMessage):
+        message = message.source
+    if type(message) is MessageSpool:
+        return message.getvalue()
+    if type(message) is bytes:
+        return message
+    if type(message) is str:
+        return message.encode('utf-8')
+    if isinstance(message, Message):
+        return message.as_bytes()
+    raise Exception('Unsupported message type')
+
+
+class RelayJob(object):
+    """Progress of one /send/ request."""
+
+    def __init__(self, total):
+        self.id = uuid.uuid4().hex
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.errors = []
+        self.created = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.sent + self.failed < self.total:
+            return 'queued'
+        return 'failed' if self.failed == self.total else ('partial' if self.failed else 'sent')
+
+    def done(self, index, error=None):
+        with self._lock:
+            if error is None:
+                self.sent += 1
+            else:
+                self.failed += 1
+                self.errors.append({'index': index, 'error': str(error)})
+            if self.sent + self.failed == self.total:
+                self.finished = time.time()
+
+    def status(self):
+        """:rtype: dict"""
+        with self._lock:
+            return {
+                'id': self.id,
+                'state': self.state,
+                'total': self.total,
+                'sent': self.sent,
+                'failed': self.failed,
+                'errors': list(self.errors),
+            }
+
+
+class ConnectionPool(object):
+    """Idle persistent SMTP connections to one host, connections are checked by NOOP after idling."""
+
+    def __init__(self, host, port, timeout=30.0, max_idle=4, check_after=5.0):
+        self.host = host
+        self.port = port
+        self._timeout = timeout
+        self._max_idle = max_idle
+        self._check_after = check_after
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """:rtype: smtplib.SMTP"""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                connection, released = self._idle.pop()
+            if time.time() - released < self._check_after:
+                return connection
+            try:
+                if connection.noop()[0] == 250:
+                    return connection
+            except smtplib.SMTPException:
+                pass
+            self._quit(connection)
+        connection = smtplib.SMTP(self.host, self.port, timeout=self._timeout)
+        connection.ehlo_or_helo_if_needed()
+        return connection
+
+    def release(self, connection):
+        with self._lock:
+            if len(self._idle) < self._max_idle:
+                self._idle.append((connection, time.time()))
+                return
+        self._quit(connection)
+
+    def discard(self, connection):
+        self._quit(connection)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for connection, released in idle:
+            self._quit(connection)
+
+    @staticmethod
+    def _quit(connection):
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+
+class _Destination(object):
+    """Queue of envelopes for one host, drained by at most max_workers threads."""
+
+    def __init__(self, pool, max_workers):
+        self.pool = pool
+        self.max_workers = max_workers
+        self.queue = deque()
+        self.workers = 0
+
+
+class SmtpRelay(Route):
+    """
+    Relays messages through outbound SMTP. Envelopes are queued per destination host, every host
+    has pool of persistent connections and at most max_per_host sending threads, each thread sends
+    queued envelopes one after another over single connection.
+    """
+
+    def __init__(self, host=None, port=25, max_per_host=4, timeout=30.0, jobs=10000):
+        """
+        :param host: smart host receiving all messages, recipient domain is destination host if none
+        :param max_per_host: cap of concurrent connections to one destination host
+        :param jobs: count of recent jobs kept for status queries
+        """
+        self._host = host
+        self._port = port
+        self._max_per_host = max_per_host
+        self._timeout = timeout
+        self._max_jobs = jobs
+        self._destinations = {}
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def destination(self, recipient):
+        """
+        :return: host which receives message for recipient, there is no MX lookup, recipient domain is
+            connected directly unless smart host is configured
+        """
+        return self._host or recipient.rsplit('@', 1)[-1].lower()
+
+    def submit(self, envelopes):
+        """
+        Queue messages, returns immediately.
+        :param envelopes: (from, recipients, message) triples, message is email message, str or bytes
+        :type envelopes: list<tuple>
+        :rtype: RelayJob
+        """
+        job = RelayJob(len(envelopes))
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self._max_jobs:
+                self._jobs.popitem(last=False)
+        for index, (from_, to, message) in enumerate(envelopes):
+            self._enqueue(from_, to, _message_bytes(message), job, index)
+        return job
+
+    def send(self, message, from_, to):
+        """
+        :param from_: sender address, or (name, address) pairs parsed by router of which first is used
+        """
+        if not isinstance(from_, str):
+            from_ = from_[0][1] if from_ else ''
+        self.submit([(from_, list(to), message)])
+
+    def job(self, job_id):
+        """:rtype: RelayJob|None"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _enqueue(self, from_, to, data, job, index):
+        by_host = OrderedDict()
+        for recipient in to:
+            by_host.setdefault(self.destination(recipient), []).append(recipient)
+        if not by_host:
+            job.done(index, 'No recipients')
+        elif len(by_host) > 1:
+            # message is done once its last destination reports, first error wins
+            job = _SplitJob(job, len(by_host))
+        for host, recipients in by_host.items():
+            self._put(host, (from_, recipients, data, job, index))
+
+    def _put(self, host, envelope):
+        with self._lock:
+            destination = self._destinations.get(host)
+            if destination is None:
+                destination = self._destinations[host] = _Destination(
+                    ConnectionPool(host, self._port, self._timeout, self._max_per_host), self._max_per_host)
+            destination.queue.append(envelope)
+            if destination.workers >= destination.max_workers:
+                return
+            destination.workers += 1
+        thread = threading.Thread(target=self._drain, args=(destination,), name='relay-%s' % host)
+        thread.daemon = True
+        thread.start()
+
+    def _next(self, destination):
+        with self._lock:
+            if destination.queue:
+                return destination.queue.popleft()
+            destination.workers -= 1
+            return None
+
+    def _drain(self, destination):
+        connection = None
+        envelope = None
+        try:
+            envelope = self._next(destination)
+            while envelope is not None:
+                from_, to, data, job, index = envelope
+                try:
+                    if connection is None:
+                        connection = destination.pool.acquire()
+                    try:
+                        refused = connection.sendmail(from_, to, data)
+                    except smtplib.SMTPServerDisconnected:
+                        # persistent connection closed by server, retry once over fresh one
+                        destination.pool.discard(connection)
+                        connection = None
+                        connection = destination.pool.acquire()
+                        refused = connection.sendmail(from_, to, data)
+                    job.done(index, 'Refused recipients %s' % sorted(refused) if refused else None)
+                except Exception as e:
+                    job.done(index, e)
+                    if connection is not None and not isinstance(e, (smtplib.SMTPRecipientsRefused,
+                                                                       smtplib.SMTPSenderRefused,
+                                                                       smtplib.SMTPDataError)):
+                        destination.pool.discard(connection)
+                        connection = None
+                envelope = self._next(destination)
+        finally:
+            if connection is not None:
+                destination.pool.release(connection)
+            if envelope is not None:
+                # worker did not finish queue, so _next did not release its slot
+                with self._lock:
+                    destination.workers -= 1
+
+    def close(self):
+        with self._lock:
+            destinations = list(self._destinations.values())
+        for destination in destinations:
+            destination.pool.close()
+
+
+class _SplitJob(object):
+    """Reports message sent to several destination hosts once."""
+
+    def __init__(self, job, parts):
+        self._job = job
+        self._parts = parts
+        self._error = None
+        self._lock = threading.Lock()
+
+    def done(self, index, error=None):
+        with self._lock:
+            self._parts -= 1
+            if error is not None and self._error is None:
+                self._error = error
+            if self._parts:
+                return
+        self._job.done(index, self._error)
+
+
+_RELAY = None
+_RELAY_LOCK = threading.Lock()
+
+
+def get_relay():
+    """
+    :return: process wide relay configured by settings.RELAY_* values
+    :rtype: SmtpRelay
+    """
+    global _RELAY
+    with _RELAY_LOCK:
+        if _RELAY is None:
+            _RELAY = SmtpRelay(settings.RELAY_HOST, settings.RELAY_PORT, settings.RELAY_MAX_PER_HOST,
+                               settings.RELAY_TIMEOUT)
+        return _RELAY
@@ -0,0 +1,55 @@
+"""Deletion of old messages and removal of blobs no message part references any more."""
+from sqlalchemy import select
+
+from mail_srv.blobs import BlobStore
+from mail_srv.models import Message, MessageRecipient
+from mail_srv.search import get_index
+
+
+def delete_messages(connection, message_ids, blobs=None):
+    """
+    Delete messages with their recipients and parts, references of part blobs are released,
+    orphaned blobs are left for BlobStore.collect.
+    :type message_ids: list<int>
+    :type blobs: mail_srv.blobs.BlobStore
+    :return: count of deleted messages
+    :rtype: int
+    """
+    if not message_ids:
+        return 0
+    (blobs or BlobStore()).release(connection, message_ids)
+    recipient, message = MessageRecipient.__table__, Message.__table__
+    connection.execute(recipient.delete().where(recipient.c.message_id.in_(message_ids)))
+    return connection.execute(message.delete().where(message.c.id.in_(message_ids))).rowcount
+
+
+def purge(engine, before=None, batch_size=1000, recount=False, search_index=None):
+    """
+    Delete messages received before given time, batch by batch in own transactions, then collect
+    orphaned blobs.
+    :param before: messages with older date_created are deleted, only blobs are collected if none
+    :type before: datetime.datetime
+    :param recount: recompute blob references from message parts before collecting
+    :param search_index: index deleted messages are dropped from, process wide index of engine if none
+    :return: (deleted messages, removed blobs)
+    :rtype: tuple<int>
+    """
+    if search_index is None:
+        search_index = get_index(engine)
+    message = Message.__table__
+    blobs = BlobStore()
+    deleted = 0
+    while before is not None:
+        with engine.begin() as connection:
+            ids = [row[0] for row in connection.execute(
+                select(message.c.id).where(message.c.date_created < before).order_by(message.c.id).limit(batch_size))]
+            if not ids:
+                break
+            deleted += delete_messages(connection, ids, blobs)
+            if search_index.transactional:
+                search_index.delete(connection, ids)
+        if not search_index.transactional:
+            search_index.delete(None, ids)
+    with engine.begin() as connection:
+        removed = blobs.collect(connection, recount)
+    return deleted, removed
@@ -0,0 +1,182 @@
+"""Full text search over received messages."""
+import heapq
+import math
+import re
+import threading
+
+from abc import ABCMeta, abstractmethod
+from sqlalchemy import inspect, text
+
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(value):
+    """
+    :rtype: list<str>
+    """
+    return _TOKEN.findall(value.lower()) if value else []
+
+
+class SearchIndex(object):
+    """Incremental inverted index of message subject, sender, recipients and text bodies."""
+    __metaclass__ = ABCMeta
+
+    # index is written in flush transaction, otherwise after commit
+    transactional = True
+
+    @abstractmethod
+    def add(self, connection, documents):
+        """
+        Index stored messages, called by mail_srv.writer.BatchWriter on flush.
+        :param documents: dicts with id, subject, sender, recipients and body keys
+        :type documents: list<dict>
+        """
+        pass
+
+    @abstractmethod
+    def search(self, query, limit=20, offset=0):
+        """
+        :return: ids of matching messages, best ranked first
+        :rtype: list<int>
+        """
+        pass
+
+    @abstractmethod
+    def delete(self, connection, message_ids):
+        """
+        Drop deleted messages from index.
+        :type message_ids: list<int>
+        """
+        pass
+
+
+def fts5_supported(connection):
+    """:return: True for SQLite compiled with FTS5 extension"""
+    if connection.dialect.name != 'sqlite':
+        return False
+    options = [row[0] for row in connection.exec_driver_sql('PRAGMA compile_options')]
+    return 'ENABLE_FTS5' in options
+
+
+class Fts5Index(SearchIndex):
+    """
+    Index kept in SQLite FTS5 virtual table next to messages, ranked by bm25. Table is created
+    and filled with existing messages by mail_srv.migrations.
+    """
+
+    TABLE = 'message_fts'
+
+    def __init__(self, engine):
+        self._engine = engine
+        self._insert = text('INSERT INTO %s (rowid, subject, sender, recipients, body) '
+                            'VALUES (:id, :subject, :sender, :recipients, :body)' % self.TABLE)
+        self._select = text('SELECT rowid FROM %s WHERE %s MATCH :query ORDER BY rank LIMIT :limit OFFSET :offset'
+                            % (self.TABLE, self.TABLE))
+        self._delete = text('DELETE FROM %s WHERE rowid = :id' % self.TABLE)
+
+    @classmethod
+    def available(cls, engine):
+        """:return: True if database of engine has migrated FTS5 table"""
+        with engine.connect() as connection:
+            return fts5_supported(connection) and inspect(connection).has_table(cls.TABLE)
+
+    def add(self, connection, documents):
+        if documents:
+            connection.execute(self._insert, documents)
+
+    def delete(self, connection, message_ids):
+        connection.execute(self._delete, [{'id': id_} for id_ in message_ids])
+
+    def search(self, query, limit=20, offset=0):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        match = ' '.join('"%s"' % token for token in tokens)
+        with self._engine.connect() as connection:
+            rows = connection.execute(self._select, {'query': match, 'limit': limit, 'offset': offset})
+            return [row[0] for row in rows]
+
+
+class MemoryIndex(SearchIndex):
+    """In process inverted index ranked by BM25, for databases without full text support."""
+
+    K1 = 1.2
+    B = 0.75
+    transactional = False
+
+    def __init__(self):
+        self._postings = {}
+        self._tokens = {}
+        self._lengths = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def add(self, connection, documents):
+        for document in documents:
+            frequencies = {}
+            for field in ('subject', 'sender', 'recipients', 'body'):
+                for token in tokenize(document[field]):
+                    frequencies[token] = frequencies.get(token, 0) + 1
+            length = sum(frequencies.values())
+            with self._lock:
+                for token, frequency in frequencies.items():
+                    self._postings.setdefault(token, {})[document['id']] = frequency
+                self._tokens[document['id']] = tuple(frequencies)
+                self._lengths[document['id']] = length
+                self._total_length += length
+
+    def remove(self, message_id):
+        """Drop message from index, used when message is evicted from storage."""
+        with self._lock:
+            for token in self._tokens.pop(message_id, ()):
+                posting = self._postings[token]
+                del posting[message_id]
+                if not posting:
+                    del self._postings[token]
+            self._total_length -= self._lengths.pop(message_id, 0)
+
+    def delete(self, connection, message_ids):
+        for message_id in message_ids:
+            self.remove(message_id)
+
+    def search(self, query, limit=20, offset=0):
+        tokens = set(tokenize(query))
+        if not tokens:
+            return []
+        with self._lock:
+            postings = [self._postings.get(token) for token in tokens]
+            if not all(postings):
+                return []
+            postings.sort(key=len)
+            count = len(self._lengths)
+            average = float(self._total_length) / count
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates.intersection_update(posting)
+            scores = []
+            for message_id in candidates:
+                norm = self.K1 * (1 - self.B + self.B * self._lengths[message_id] / average)
+                score = 0.0
+                for posting in postings:
+                    frequency = posting[message_id]
+                    idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+                    score += idf * frequency * (self.K1 + 1) / (frequency + norm)
+                scores.append((score, message_id))
+        return [message_id for score, message_id in heapq.nlargest(offset + limit, scores)[offset:]]
+
+
+_INDEX = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_index(engine):
+    """
+    :return: process wide search index, FTS5 backed on SQLite with FTS5 table, in memory otherwise
+    :rtype: SearchIndex
+    """
+    global _INDEX
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            _INDEX = Fts5Index(engine) if Fts5Index.available(engine) else MemoryIndex()
+        return _INDEX
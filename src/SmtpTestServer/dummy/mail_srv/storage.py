@@ -0,0 +1,396 @@
+"""Storage backends behind controllers."""
+import threading
+import uuid
+from collections import OrderedDict
+
+from abc import ABCMeta, abstractmethod
+from sqlalchemy import and_, func, or_, select
+
+import settings
+from mail_srv.content import BytesContent, column_content, part_content_type
+from mail_srv.models import Blob, Message, MessagePart, MessageRecipient
+from mail_srv.notify import get_notifier
+from mail_srv.search import MemoryIndex, get_index
+from mail_srv.text import create_preview
+from mail_srv.writer import create_message_row, create_part_rows, create_recipient_rows, create_recipients, \
+    create_search_document
+from router.router import _Sink
+
+
+# columns needed by controllers.create_message, source and part bodies are never loaded for listing
+LIST_COLUMNS = (Message.id, Message.sender, Message.subject, Message.preview, Message.date_created)
+
+
+class Storage(object):
+    """
+    Read side of message storage. Listed messages expose id, sender, subject, preview and
+    date_created attributes.
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def list_messages(self, limit, cursor=None, mailbox=None, sender=None, subject=None):
+        """
+        :param cursor: (date_created, id) of last message of previous page
+        :return: page of messages, newest first
+        :rtype: list
+        """
+        pass
+
+    @abstractmethod
+    def get_message(self, id_):
+        """
+        :return: message with size attribute, its (kind, name, email) recipients and (id, part_type, file_name,
+            size) parts, None if not found
+        :rtype: tuple|None
+        """
+        pass
+
+    @abstractmethod
+    def find_message(self, after=0, recipient=None, sender=None, subject=None):
+        """
+        :return: oldest message matching filters, None if there is none
+        """
+        pass
+
+    @abstractmethod
+    def search(self, query, limit, offset=0):
+        """
+        :return: messages matching full text query, best ranked first
+        :rtype: list
+        """
+        pass
+
+    @abstractmethod
+    def get_source(self, id_):
+        """
+        :return: raw source of message, None if not found
+        :rtype: mail_srv.content.Content|None
+        """
+        pass
+
+    @abstractmethod
+    def get_part(self, id_, part_id):
+        """
+        :return: body of message part, None if message has no such part
+        :rtype: mail_srv.content.Content|None
+        """
+        pass
+
+
+class DatabaseStorage(Storage):
+    """Messages stored through SQLAlchemy, written by mail_srv.writer.BatchWriter."""
+
+    def __init__(self, session_factory, engine):
+        self._session_factory = session_factory
+        self._engine = engine
+
+    def list_messages(self, limit, cursor=None, mailbox=None, sender=None, subject=None):
+        session = self._session_factory()
+        try:
+            query = session.query(*LIST_COLUMNS)
+            if mailbox is not None:
+                query = query.filter(Message.mailbox_id == mailbox)
+            if sender is not None:
+                query = query.filter(Message.sender == sender)
+            if subject is not None:
+                query = query.filter(Message.subject.contains(subject))
+            if cursor is not None:
+                date_created, id_ = cursor
+                query = query.filter(or_(Message.date_created < date_created,
+                                         and_(Message.date_created == date_created, Message.id < id_)))
+            return query.order_by(Message.date_created.desc(), Message.id.desc()).limit(limit).all()
+        finally:
+            session.close()
+
+    def get_message(self, id_):
+        session = self._session_factory()
+        try:
+            message = session.query(Message.size, *LIST_COLUMNS).filter_by(id=id_).first()
+            if message is None:
+                return None
+            recipients = session.query(MessageRecipient.kind, MessageRecipient.name, MessageRecipient.email)\
+                .filter_by(message_id=id_).order_by(MessageRecipient.id).all()
+            # legacy parts without size column keep body inline
+            parts = session.query(MessagePart.id, MessagePart.part_type, MessagePart.file_name,
+                                  func.coalesce(MessagePart.size, func.length(MessagePart.body)))\
+                .filter_by(message_id=id_).order_by(MessagePart.id).all()
+            return message, recipients, parts
+        finally:
+            session.close()
+
+    def find_message(self, after=0, recipient=None, sender=None, subject=None):
+        session = self._session_factory()
+        try:
+            query = session.query(*LIST_COLUMNS).filter(Message.id > after)
+            if recipient is not None:
+                query = query.filter(Message.id.in_(session.query(MessageRecipient.message_id)
+                                                    .filter(MessageRecipient.email == recipient)))
+            if sender is not None:
+                query = query.filter(Message.sender == sender)
+            if subject is not None:
+                query = query.filter(Message.subject.contains(subject))
+            return query.order_by(Message.id).first()
+        finally:
+            session.close()
+
+    def search(self, query, limit, offset=0):
+        ids = get_index(self._engine).search(query, limit, offset)
+        if not ids:
+            return []
+        session = self._session_factory()
+        try:
+            messages = dict((message.id, message)
+                            for message in session.query(*LIST_COLUMNS).filter(Message.id.in_(ids)))
+        finally:
+            session.close()
+        return [messages[id_] for id_ in ids if id_ in messages]
+
+    def get_source(self, id_):
+        message = Message.__table__
+        with self._engine.connect() as connection:
+            row = connection.execute(select(message.c.uid, func.length(message.c.source))
+                                     .where(message.c.id == id_)).first()
+        if row is None or row[1] is None:
+            return None
+        uid, size = row
+        return column_content(self._engine, message.c.source, message.c.id, id_, size,
+                              '"%s"' % (uid or 'message-%d' % id_), 'message/rfc822')
+
+    def get_part(self, id_, part_id):
+        part, blob = MessagePart.__table__, Blob.__table__
+        with self._engine.connect() as connection:
+            row = connection.execute(
+                select(part.c.part_type, part.c.charset, part.c.file_name, part.c.blob_hash,
+                       func.length(part.c.body))
+                .where(part.c.id == part_id).where(part.c.message_id == id_)).first()
+            if row is None:
+                return None
+            part_type, charset, file_name, blob_hash, legacy_size = row
+            content_type = part_content_type(part_type, charset)
+            if blob_hash is None:
+                if legacy_size is None:
+                    return None
+                return column_content(self._engine, part.c.body, part.c.id, part_id, legacy_size,
+                                      '"part-%d"' % part_id, content_type, file_name)
+            size = connection.execute(select(func.length(blob.c.body)).where(blob.c.hash == blob_hash)).scalar()
+        # blobs are content addressed, hash is strong entity tag shared by equal bodies
+        return column_content(self._engine, blob.c.body, blob.c.hash, blob_hash, size or 0, '"%s"' % blob_hash,
+                              content_type, file_name)
+
+
+class MessageRecord(object):
+    """Message kept by MemoryStorage."""
+    __slots__ = ('id', 'mailbox_id', 'sender', 'subject', 'preview', 'date_created', 'size', 'recipients',
+                 'source', 'parts', 'footprint')
+
+    # rough per record cost of slots, tuples and index entries
+    OVERHEAD = 512
+
+    def __init__(self, id_, mailbox_id, sender, subject, preview, date_created, source, recipients, parts):
+        self.id = id_
+        self.mailbox_id = mailbox_id
+        self.sender = sender
+        self.subject = subject
+        self.preview = preview
+        self.date_created = date_created
+        self.source = source
+        self.size = len(source)
+        self.recipients = recipients
+        self.parts = parts
+        self.footprint = self.size + sum(part.size for part in parts) + MessageRecord.OVERHEAD
+
+
+class PartRecord(object):
+    __slots__ = ('id', 'cid', 'part_type', 'is_attachement', 'file_name', 'charset', 'body', 'size')
+
+    def __init__(self, id_, row):
+        self.id = id_
+        self.cid = row['cid']
+        self.part_type = row['part_type']
+        self.is_attachement = row['is_attachement']
+        self.file_name = row['file_name']
+        self.charset = row['charset']
+        self.body = row['body']
+        self.size = row['size']
+
+
+class MemoryStorage(Storage, _Sink):
+    """
+    Ephemeral storage, bounded ring buffer of message records with per mailbox and per recipient
+    indexes. Oldest messages are evicted once max_messages or max_bytes is exceeded. It is sink
+    of received messages itself, so no database is needed.
+    """
+
+    def __init__(self, max_messages=100000, max_bytes=512 * 1024 * 1024, mailbox_id=None, listeners=()):
+        """
+        :param max_messages: maximal count of kept messages
+        :param max_bytes: approximate memory cap of kept sources and part bodies
+        :param mailbox_id: mailbox of received messages
+        :param listeners: callables receiving summaries of stored messages, see mail_srv.writer.BatchWriter
+        """
+        self._max_messages = max_messages
+        self._max_bytes = max_bytes
+        self._mailbox_id = mailbox_id
+        self._listeners = list(listeners)
+        self._lock = threading.Lock()
+        self._messages = OrderedDict()
+        self._mailboxes = {}
+        self._recipients = {}
+        self._bytes = 0
+        self._last_id = 0
+        self._last_part_id = 0
+        self._index = MemoryIndex()
+        # ids restart in every process, entity tags must not match content cached from previous one
+        self._etag_prefix = 'memory-%s' % uuid.uuid4().hex[:16]
+        self.evicted = 0
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._messages)
+
+    def receive(self, message, from_, to):
+        recipients = create_recipients(message)
+        part_rows = create_part_rows(message)
+        recipient_rows = create_recipient_rows(recipients)
+        row = create_message_row(message, self._mailbox_id, recipients, create_preview(part_rows))
+        source = bytes(row['source'])
+        # text is extracted outside of lock, document gets id of record
+        document = create_search_document(None, row, part_rows, recipient_rows)
+        with self._lock:
+            self._last_id += 1
+            document['id'] = self._last_id
+            parts = []
+            for part_row in part_rows:
+                self._last_part_id += 1
+                parts.append(PartRecord(self._last_part_id, part_row))
+            record = MessageRecord(self._last_id, row['mailbox_id'], row['sender'], row['subject'], row['preview'],
+                                   row['date_created'], source,
+                                   tuple((rcp['kind'], rcp['name'], rcp['email']) for rcp in recipient_rows),
+                                   tuple(parts))
+            # indexed in ring buffer order before message is visible, evicted record is dropped from index again
+            self._index.add(None, [document])
+            self._put(record)
+        summary = {
+            'id': record.id,
+            'sender': record.sender,
+            'subject': record.subject,
+            'preview': record.preview,
+            'date_created': record.date_created,
+            'recipients': frozenset(email for kind, name, email in record.recipients),
+        }
+        for listener in self._listeners:
+            listener([summary])
+
+    def _put(self, record):
+        self._messages[record.id] = record
+        self._mailboxes.setdefault(record.mailbox_id, OrderedDict())[record.id] = record
+        for kind, name, email in record.recipients:
+            self._recipients.setdefault(email, OrderedDict())[record.id] = record
+        self._bytes += record.footprint
+        while self._messages and (len(self._messages) > self._max_messages or self._bytes > self._max_bytes):
+            self._evict()
+
+    def _evict(self):
+        id_, record = self._messages.popitem(last=False)
+        self._bytes -= record.footprint
+        self._index.remove(id_)
+        self._remove_from(self._mailboxes, record.mailbox_id, id_)
+        for kind, name, email in record.recipients:
+            self._remove_from(self._recipients, email, id_)
+        self.evicted += 1
+
+    @staticmethod
+    def _remove_from(index, key, id_):
+        records = index.get(key)
+        if records is not None:
+            records.pop(id_, None)
+            if not records:
+                del index[key]
+
+    def list_messages(self, limit, cursor=None, mailbox=None, sender=None, subject=None):
+        with self._lock:
+            records = self._messages if mailbox is None else self._mailboxes.get(mailbox, {})
+            page = []
+            for id_ in reversed(records):
+                record = records[id_]
+                if cursor is not None and (record.date_created, record.id) >= cursor:
+                    continue
+                if sender is not None and record.sender != sender:
+                    continue
+                if subject is not None and subject not in (record.subject or ''):
+                    continue
+                page.append(record)
+                if len(page) >= limit:
+                    break
+            return page
+
+    def get_message(self, id_):
+        record = self._messages.get(id_)
+        if record is None:
+            return None
+        return record, record.recipients, [(part.id, part.part_type, part.file_name, part.size)
+                                           for part in record.parts]
+
+    def find_message(self, after=0, recipient=None, sender=None, subject=None):
+        with self._lock:
+            records = self._messages if recipient is None else self._recipients.get(recipient, {})
+            for record in records.values():
+                if record.id <= after:
+                    continue
+                if sender is not None and record.sender != sender:
+                    continue
+                if subject is not None and subject not in (record.subject or ''):
+                    continue
+                return record
+        return None
+
+    def search(self, query, limit, offset=0):
+        records = []
+        for id_ in self._index.search(query, limit, offset):
+            record = self._messages.get(id_)
+            if record is not None:
+                records.append(record)
+        return records
+
+    def get_source(self, id_):
+        record = self._messages.get(id_)
+        if record is None:
+            return None
+        return BytesContent(record.source, '"%s-%d"' % (self._etag_prefix, record.id), 'message/rfc822')
+
+    def get_part(self, id_, part_id):
+        record = self._messages.get(id_)
+        if record is None:
+            return None
+        for part in record.parts:
+            if part.id == part_id:
+                return BytesContent(part.body or b'', '"%s-part-%d"' % (self._etag_prefix, part.id),
+                                    part_content_type(part.part_type, part.charset), part.file_name)
+        return None
+
+
+_STORAGE = None
+_STORAGE_LOCK = threading.Lock()
+
+
+def get_storage():
+    """
+    :return: process wide storage selected by settings.STORAGE
+    :rtype: Storage
+    """
+    global _STORAGE
+    with _STORAGE_LOCK:
+        if _STORAGE is None:
+            if settings.STORAGE == 'memory':
+                _STORAGE = MemoryStorage(settings.MEMORY_STORAGE_MAX_MESSAGES, settings.MEMORY_STORAGE_MAX_BYTES,
+                                         listeners=[get_notifier().publish])
+            else:
+                _STORAGE = DatabaseStorage(settings.Session, settings.engine)
+        return _STORAGE
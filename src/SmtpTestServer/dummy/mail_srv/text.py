@@ -0,0 +1,78 @@
+"""Text extraction from message parts."""
+import re
+from html.parser import HTMLParser
+
+
+PREVIEW_LENGTH = 255
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+class _TextExtractor(HTMLParser):
+    _SKIPPED = ('script', 'style', 'head', 'title')
+
+    def __init__(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self._chunks = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _TextExtractor._SKIPPED:
+            self._skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in _TextExtractor._SKIPPED and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if not self._skip:
+            self._chunks.append(data)
+
+    @property
+    def text(self):
+        return ' '.join(self._chunks)
+
+
+def strip_html(html):
+    """
+    :return: text content of html document
+    :rtype: str
+    """
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return extractor.text
+
+
+def decode_part_text(part):
+    """
+    :param part: message_part row values
+    :type part: dict
+    :return: decoded text of text/plain or text/html part, None for other parts
+    :rtype: str|None
+    """
+    if part['is_attachement'] or part['part_type'] not in ('text/plain', 'text/html'):
+        return None
+    try:
+        text = part['body'].decode(part['charset'] or 'utf-8', 'replace')
+    except LookupError:
+        text = part['body'].decode('utf-8', 'replace')
+    if part['part_type'] == 'text/html':
+        text = strip_html(text)
+    return text
+
+
+def create_preview(parts, length=PREVIEW_LENGTH):
+    """
+    Preview from first text/plain part, or from first text/html part stripped of markup.
+    :param parts: message_part row values
+    :type parts: list<dict>
+    :rtype: str
+    """
+    for part_type in ('text/plain', 'text/html'):
+        for part in parts:
+            if part['part_type'] == part_type:
+                text = decode_part_text(part)
+                if text is not None:
+                    return _WHITESPACE.sub(' ', text).strip()[:length]
+    return ''
@@ -0,0 +1,309 @@
+"""Write-behind persistence of received messages."""
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime
+from email.utils import getaddresses
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+import metrics
+from mail_srv.blobs import BlobStore
+from mail_srv.models import Message, MessagePart, MessageRecipient
+from mail_srv.notify import get_notifier
+from mail_srv.search import get_index
+from mail_srv.text import create_preview, decode_part_text
+from router.router import _Sink, DeliveryException
+
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = metrics.histogram('db_flush_seconds', 'Duration of batch writer flush transactions')
+FLUSHED_MESSAGES = metrics.counter('db_flushed_messages_total', 'Messages written by batch writer', ('result',))
+
+
+def create_recipients(message):
+    """
+    :type message: router.message.ReceivedMessage
+    :return: recipient addresses by header
+    :rtype: dict<str, list>
+    """
+    recipients = {}
+    for header in ('to', 'cc', 'bcc'):
+        recipients[header] = getaddresses(message.get_all(header, []))
+    return recipients
+
+
+def create_recipient_rows(recipients):
+    """
+    :return: values of message_recipient table rows, without message_id
+    :rtype: list<dict>
+    """
+    return [{'kind': kind, 'name': name, 'email': email}
+            for kind, addresses in recipients.items() for name, email in addresses]
+
+
+def create_message_row(message, mailbox_id=None, recipients=None, preview=None):
+    """
+    :type message: router.message.ReceivedMessage
+    :return: values of message table row
+    :rtype: dict
+    """
+    if recipients is None:
+        recipients = create_recipients(message)
+    senders = getaddresses(message.get_all('from', []))
+    source = message.source
+    if hasattr(source, 'view'):
+        source = source.view()
+    elif type(source) is str:
+        source = source.encode('utf-8', 'surrogateescape')
+    return {
+        'uid': uuid.uuid4().hex,
+        'mailbox_id': mailbox_id,
+        'sender': senders[0][1] if senders else None,
+        'recipients': json.dumps(recipients),
+        'subject': message.get('subject'),
+        'preview': preview,
+        'source': source,
+        'size': len(source),
+        'date_created': datetime.utcnow(),
+    }
+
+
+def create_search_document(message_id, message_row, part_rows, recipient_rows):
+    """
+    :return: document for mail_srv.search.SearchIndex
+    :rtype: dict
+    """
+    texts = (decode_part_text(part) for part in part_rows)
+    return {
+        'id': message_id,
+        'subject': message_row['subject'] or '',
+        'sender': message_row['sender'] or '',
+        'recipients': ' '.join('%s %s' % (row['name'], row['email']) for row in recipient_rows),
+        'body': '\n'.join(text for text in texts if text),
+    }
+
+
+def create_part_rows(message):
+    """
+    :type message: router.message.ReceivedMessage
+    :return: values of message_part table rows, without message_id, body is stored in blob store
+    :rtype: list<dict>
+    """
+    rows = []
+    created_at = datetime.utcnow()
+    for part in message.message.walk():
+        if part.is_multipart():
+            continue
+        body = part.get_payload(decode=True) or b''
+        rows.append({
+            'cid': part.get('content-id'),
+            'part_type': part.get_content_type(),
+            'is_attachement': 1 if part.get_content_disposition() == 'attachment' else 0,
+            'file_name': part.get_filename(),
+            'charset': part.get_content_charset(),
+            'body': body,
+            'size': len(body),
+            'created_at': created_at,
+        })
+    return rows
+
+
+class _Batch(object):
+
+    def __init__(self):
+        self.messages = []
+        self.parts = []
+        self.recipients = []
+        self.sources = []
+        self.flushed = threading.Event()
+        self.error = None
+
+
+class BatchWriter(_Sink):
+    """
+    Persistence sink collecting received messages, which are flushed in bulk (executemany)
+    every batch_size messages or flush_interval milliseconds. In durable mode receive returns
+    only after the batch holding message is flushed, so SMTP listener acknowledges stored mail.
+    """
+
+    def __init__(self, engine, batch_size=500, flush_interval=200, durable=False, mailbox_id=None,
+                 search_index=None, listeners=None, durable_timeout=30.0):
+        """
+        :param engine: sqlalchemy engine
+        :param batch_size: count of messages which triggers flush
+        :param flush_interval: maximal age of batch in milliseconds
+        :param durable: block receive until message is flushed
+        :param mailbox_id: mailbox of stored messages
+        :param search_index: index updated with stored messages, process wide index of engine if none,
+            False disables indexing
+        :type search_index: mail_srv.search.SearchIndex|bool
+        :param listeners: callables receiving summaries of stored messages after each flush, publish of
+            process wide notifier if none, so /inbox/wait is woken up
+        :param durable_timeout: seconds durable receive waits for flush, message may still be stored
+            after it has been reported as failed
+        """
+        self._engine = engine
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval / 1000.0
+        self._durable = durable
+        self._durable_timeout = durable_timeout
+        self._mailbox_id = mailbox_id
+        if search_index is None:
+            search_index = get_index(engine)
+        self._search_index = search_index or None
+        if listeners is None:
+            listeners = [get_notifier().publish]
+        self._listeners = list(listeners)
+        self._lock = threading.Condition()
+        self._batch = _Batch()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._blobs = BlobStore()
+        self.flushes = 0
+        self.flushed_messages = 0
+
+    def add_listener(self, listener):
+        """
+        :param listener: callable receiving list of stored message summaries (dicts with id, sender,
+            subject, preview, date_created and recipients keys), e.g. mail_srv.notify.MessageNotifier.publish
+        """
+        self._listeners.append(listener)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='batch-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._running = False
+            self._lock.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def receive(self, message, from_, to):
+        recipients = create_recipients(message)
+        part_rows = create_part_rows(message)
+        message_row = create_message_row(message, self._mailbox_id, recipients, create_preview(part_rows))
+        message.retain()
+        with self._lock:
+            batch = self._batch
+            batch.messages.append(message_row)
+            batch.parts.append(part_rows)
+            batch.recipients.append(create_recipient_rows(recipients))
+            batch.sources.append(message)
+            if len(batch.messages) >= self._batch_size:
+                self._lock.notify()
+        if self._durable:
+            if not batch.flushed.wait(self._durable_timeout):
+                raise DeliveryException('Message was not flushed in %.1f s' % self._durable_timeout)
+            if batch.error is not None:
+                raise DeliveryException('Message was not stored: %s' % batch.error)
+
+    def _swap(self):
+        with self._lock:
+            batch = self._batch
+            self._batch = _Batch()
+        return batch
+
+    def flush(self):
+        """Write collected messages in one transaction."""
+        with self._flush_lock:
+            batch = self._swap()
+            if batch.messages:
+                try:
+                    with FLUSH_SECONDS.time():
+                        try:
+                            stored = self._write(batch)
+                        except IntegrityError:
+                            # concurrent writer stored the same new blob, it is found as existing now
+                            stored = self._write(batch)
+                except Exception as e:
+                    batch.error = e
+                    FLUSHED_MESSAGES.labels('failed').inc(len(batch.messages))
+                    logger.exception('Batch of %d messages was not stored', len(batch.messages))
+                else:
+                    self.flushes += 1
+                    self.flushed_messages += len(batch.messages)
+                    FLUSHED_MESSAGES.labels('stored').inc(len(batch.messages))
+                    self._notify(stored)
+                for row in batch.messages:
+                    # drop views over message sources before they are released
+                    row['source'] = None
+                for message in batch.sources:
+                    message.release()
+            batch.flushed.set()
+
+    def _notify(self, stored):
+        """Call listeners with committed messages, their failure does not make messages unstored."""
+        for listener in self._listeners:
+            try:
+                listener(stored)
+            except Exception:
+                logger.exception('Listener %r failed on %d stored messages', listener, len(stored))
+
+    def _write(self, batch):
+        message_table = Message.__table__
+        part_table = MessagePart.__table__
+        recipient_table = MessageRecipient.__table__
+        index = self._search_index
+        documents, stored = [], []
+        with self._engine.begin() as connection:
+            connection.execute(message_table.insert(), batch.messages)
+            uids = [row['uid'] for row in batch.messages]
+            ids = dict(connection.execute(
+                select(message_table.c.uid, message_table.c.id).where(message_table.c.uid.in_(uids))).fetchall())
+            part_rows, recipient_rows = [], []
+            for message_row, parts, recipients in zip(batch.messages, batch.parts, batch.recipients):
+                message_id = ids[message_row['uid']]
+                for part in parts:
+                    part_rows.append(dict(part, message_id=message_id, body=None))
+                for recipient in recipients:
+                    recipient_rows.append(dict(recipient, message_id=message_id))
+                if index is not None:
+                    documents.append(create_search_document(message_id, message_row, parts, recipients))
+                stored.append({
+                    'id': message_id,
+                    'sender': message_row['sender'],
+                    'subject': message_row['subject'],
+                    'preview': message_row['preview'],
+                    'date_created': message_row['date_created'],
+                    'recipients': frozenset(recipient['email'] for recipient in recipients),
+                })
+            if recipient_rows:
+                connection.execute(recipient_table.insert(), recipient_rows)
+            if part_rows:
+                hashes = self._blobs.store(connection, [part['body'] for parts in batch.parts for part in parts])
+                for part, hash_ in zip(part_rows, hashes):
+                    part['blob_hash'] = hash_
+                connection.execute(part_table.insert(), part_rows)
+            if index is not None and index.transactional:
+                index.add(connection, documents)
+        if index is not None and not index.transactional:
+            try:
+                index.add(None, documents)
+            except Exception:
+                logger.exception('%d stored messages were not indexed', len(documents))
+        return stored
+
+    def _run(self):
+        while True:
+            with self._lock:
+                deadline = time.time() + self._flush_interval
+                while self._running and len(self._batch.messages) < self._batch_size:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._lock.wait(remaining)
+                if not self._running:
+                    return
+            self.flush()
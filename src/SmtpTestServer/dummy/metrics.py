@@ -0,0 +1,304 @@
+"""
+Process wide counters, gauges and latency histograms, exported in Prometheus text format.
+Metrics are disabled by SMTP_TEST_SERVER_METRICS=0, then every metric is shared no-op object.
+"""
+import math
+import os
+import threading
+import time
+
+
+ENABLED = os.environ.get('SMTP_TEST_SERVER_METRICS', '1') not in ('0', 'false', 'no', '')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in pairs)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric(object):
+    """Metric family, labeled children are created by labels(), unlabeled metric is its own child."""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._create_child()
+        return child
+
+    def _create_child(self):
+        return type(self)(self.name, self.documentation)
+
+    def _samples(self, labels):
+        """:return: (suffix, extra label, value) samples of unlabeled child"""
+        return ()
+
+    def collect(self):
+        """:return: lines of Prometheus text exposition"""
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.kind)]
+        children = [((), self)] if not self.labelnames else sorted(self._children.items(), key=lambda item: item[0])
+        for values, child in children:
+            for suffix, extra, value in child._samples(values):
+                lines.append('%s%s%s %s' % (self.name, suffix, _format_labels(self.labelnames, values, extra),
+                                            _format_value(value)))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super(Counter, self).__init__(name, documentation, labelnames)
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def _samples(self, labels):
+        return (('', None, self.value),)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super(Gauge, self).__init__(name, documentation, labelnames)
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def _samples(self, labels):
+        return (('', None, self.value),)
+
+
+class Histogram(_Metric):
+    """
+    Log-linear histogram in HDR style, every power of two is split into SUB_BUCKETS linear buckets,
+    so relative error of quantiles stays under 1 / SUB_BUCKETS across whole range.
+    Exported with fixed le bounds of EXPORT_BUCKETS.
+    """
+    kind = 'histogram'
+    SUB_BUCKETS = 16
+    # 2 ** -20 s is about 1 us, values are counted up to 2 ** 12 s
+    MIN_EXPONENT = -20
+    MAX_EXPONENT = 12
+    EXPORT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                      2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, name, documentation, labelnames=()):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self._counts = [0] * ((self.MAX_EXPONENT - self.MIN_EXPONENT + 1) * self.SUB_BUCKETS + 2)
+        self.count = 0
+        self.sum = 0.0
+
+    def _index(self, value):
+        if value <= 0:
+            return 0
+        mantissa, exponent = math.frexp(value)
+        if exponent < self.MIN_EXPONENT:
+            return 0
+        if exponent > self.MAX_EXPONENT:
+            return len(self._counts) - 1
+        # mantissa is in [0.5, 1)
+        return 1 + (exponent - self.MIN_EXPONENT) * self.SUB_BUCKETS + int((mantissa - 0.5) * 2 * self.SUB_BUCKETS)
+
+    def _upper_bound(self, index):
+        if index == 0:
+            return math.ldexp(0.5, self.MIN_EXPONENT)
+        if index == len(self._counts) - 1:
+            return math.inf
+        exponent, sub = divmod(index - 1, self.SUB_BUCKETS)
+        return math.ldexp(0.5 + (sub + 1) / (2.0 * self.SUB_BUCKETS), exponent + self.MIN_EXPONENT)
+
+    def observe(self, value):
+        index = self._index(value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def time(self):
+        """:return: context manager observing duration of its block"""
+        return _Timer(self)
+
+    def quantile(self, q):
+        """
+        :param q: quantile in [0, 1]
+        :return: upper bound of bucket containing quantile, 0 for empty histogram
+        """
+        with self._lock:
+            counts, count = list(self._counts), self.count
+        if not count:
+            return 0.0
+        rank, seen = q * count, 0
+        for index, bucket in enumerate(counts):
+            seen += bucket
+            if bucket and seen >= rank:
+                return self._upper_bound(index)
+        return self._upper_bound(len(counts) - 1)
+
+    def _samples(self, labels):
+        with self._lock:
+            counts, count, sum_ = list(self._counts), self.count, self.sum
+        samples, cumulative, index = [], 0, 0
+        for bound in self.EXPORT_BUCKETS:
+            while index < len(counts) and self._upper_bound(index) <= bound:
+                cumulative += counts[index]
+                index += 1
+            samples.append(('_bucket', ('le', _format_value(bound)), cumulative))
+        samples.append(('_bucket', ('le', '+Inf'), count))
+        samples.append(('_sum', None, sum_))
+        samples.append(('_count', None, count))
+        return samples
+
+
+class _Timer(object):
+    __slots__ = ('_histogram', '_start')
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._histogram.observe(time.perf_counter() - self._start)
+
+
+class _NullMetric(object):
+    """Shared metric of disabled registry, every operation is no-op."""
+    __slots__ = ()
+    value = count = 0
+    sum = 0.0
+
+    def labels(self, *values):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def time(self):
+        return _NULL_TIMER
+
+    def quantile(self, q):
+        return 0.0
+
+    def collect(self):
+        return []
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_METRIC = _NullMetric()
+_NULL_TIMER = _NullTimer()
+
+
+class Registry(object):
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric_class, name, documentation, labelnames):
+        if not self.enabled:
+            return _NULL_METRIC
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, documentation, labelnames)
+            elif type(metric) is not metric_class or metric.labelnames != tuple(labelnames):
+                raise Exception('Metric %s already registered with other type or labels' % name)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        """:rtype: Counter"""
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        """:rtype: Gauge"""
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=()):
+        """:rtype: Histogram"""
+        return self._register(Histogram, name, documentation, labelnames)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """
+        :return: all metrics in Prometheus text exposition format
+        :rtype: str
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry(ENABLED)
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.counter(name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.gauge(name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=()):
+    return REGISTRY.histogram(name, documentation, labelnames)
@@ -0,0 +1,113 @@
+"""Received message with lazily parsed MIME tree."""
+import threading
+from email import message_from_string, message_from_bytes, message_from_binary_file
+from email.message import Message
+from email.parser import BytesHeaderParser, HeaderParser
+
+from core.spool import MessageSpool
+
+
+_EMPTY_LINES = (b'\r\n', b'\n', b'')
+
+
+def _read_header_block(fp):
+    """
+    Read lines of header block, stops on first empty line.
+    :rtype: bytes
+    """
+    lines = []
+    for line in fp:
+        if line in _EMPTY_LINES:
+            break
+        lines.append(line)
+    return b''.join(lines)
+
+
+def _split_header_block(source, separators):
+    end = len(source)
+    for separator in separators:
+        idx = source.find(separator)
+        if 0 <= idx < end:
+            end = idx + len(separator)
+    return source[:end]
+
+
+class ReceivedMessage(object):
+    """
+    Message handed to routes. Only header block is parsed on receive, which is enough for
+    routing decisions, full MIME parse runs on first access of message property. Parse is guarded
+    by lock, stages running in several threads share position of source file.
+    """
+
+    def __init__(self, source):
+        """
+        :param source: raw message source, seekable binary file or already parsed message
+        :type source: core.spool.MessageSpool|bytes|str|file|email.message.Message
+        """
+        self.source = source
+        self._message = None
+        self._lock = threading.Lock()
+        source_type = type(source)
+        if source_type is MessageSpool:
+            self.headers = BytesHeaderParser().parsebytes(_read_header_block(source.open()))
+        elif source_type is bytes:
+            self.headers = BytesHeaderParser().parsebytes(_split_header_block(source, (b'\r\n\r\n', b'\n\n')))
+        elif source_type is str:
+            self.headers = HeaderParser().parsestr(_split_header_block(source, ('\r\n\r\n', '\n\n')))
+        elif isinstance(source, Message):
+            self.headers = self._message = source
+        elif hasattr(source, 'read') and hasattr(source, 'seek'):
+            source.seek(0)
+            self.headers = BytesHeaderParser().parsebytes(_read_header_block(source))
+        else:
+            raise Exception('Unsupported message type')
+
+    @property
+    def is_parsed(self):
+        return self._message is not None
+
+    @property
+    def message(self):
+        """
+        Fully parsed message, parsed on first access.
+        :rtype: email.message.Message
+        """
+        if self._message is None:
+            with self._lock:
+                if self._message is None:
+                    self._message = self._parse()
+        return self._message
+
+    def _parse(self):
+        source = self.source
+        source_type = type(source)
+        if source_type is MessageSpool:
+            return message_from_binary_file(source.open())
+        if source_type is bytes:
+            return message_from_bytes(source)
+        if source_type is str:
+            return message_from_string(source)
+        source.seek(0)
+        return message_from_binary_file(source)
+
+    def retain(self):
+        retain = getattr(self.source, 'retain', None)
+        if retain is not None:
+            retain()
+
+    def release(self):
+        release = getattr(self.source, 'release', None)
+        if release is not None:
+            release()
+
+    def get(self, name, failobj=None):
+        return self.headers.get(name, failobj)
+
+    def get_all(self, name, failobj=None):
+        return self.headers.get_all(name, failobj)
+
+    def __getitem__(self, name):
+        return self.headers[name]
+
+    def __contains__(self, name):
+        return name in self.headers
@@ -0,0 +1,188 @@
+"""Asynchronous pipeline mode of _Source/_Sink/_Handler chain, stages are connected by bounded queues."""
+import logging
+import threading
+import time
+from queue import Queue, Full
+
+import metrics
+from router.router import _Handler, _Sink
+
+
+logger = logging.getLogger(__name__)
+
+STAGE_WAIT_SECONDS = metrics.histogram('pipeline_wait_seconds', 'Time messages spent in stage queue', ('stage',))
+STAGE_PROCESS_SECONDS = metrics.histogram('pipeline_process_seconds', 'Processing of message by stage sink',
+                                          ('stage',))
+STAGE_MESSAGES = metrics.counter('pipeline_messages_total', 'Messages of pipeline stages by result',
+                                 ('stage', 'result'))
+
+
+class PipelineFull(Exception):
+    """Stage queue is full, message should be temporarily rejected."""
+    pass
+
+
+class StageMetrics(object):
+    """Counters of one stage, updated by its worker threads and by receiving threads."""
+    __slots__ = ('received', 'processed', 'failed', 'rejected', 'wait_total', 'wait_max',
+                 'process_total', 'process_max', '_lock')
+    FIELDS = __slots__[:-1]
+
+    def __init__(self):
+        self.received = self.processed = self.failed = self.rejected = 0
+        self.wait_total = self.wait_max = self.process_total = self.process_max = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def record(self, wait, process):
+        with self._lock:
+            self.processed += 1
+            self.wait_total += wait
+            self.process_total += process
+            if wait > self.wait_max:
+                self.wait_max = wait
+            if process > self.process_max:
+                self.process_max = process
+
+    def snapshot(self):
+        """:rtype: dict"""
+        with self._lock:
+            dct = dict((name, getattr(self, name)) for name in StageMetrics.FIELDS)
+        dct['wait_avg'] = dct['wait_total'] / dct['processed'] if dct['processed'] else 0.0
+        dct['process_avg'] = dct['process_total'] / dct['processed'] if dct['processed'] else 0.0
+        return dct
+
+
+class QueuedStage(_Sink):
+    """
+    Sink which puts received messages into bounded queue, worker threads hand them over to
+    wrapped sink. When queue is full, receive either blocks (inner stages) or raises PipelineFull.
+    Queued messages outlive SMTP session, so they have to support retain and release, e.g.
+    router.message.ReceivedMessage.
+    """
+
+    def __init__(self, sink, maxsize=1000, workers=1, put_timeout=None, name=None):
+        """
+        :param sink: wrapped sink
+        :type sink: router.router._Sink
+        :param maxsize: capacity of stage queue
+        :param workers: count of worker threads processing queue
+        :param put_timeout: seconds to wait for free slot, 0 rejects immediately, None blocks
+        """
+        self._sink = sink
+        self._queue = Queue(maxsize)
+        self._put_timeout = put_timeout
+        self._workers_count = workers
+        self._threads = []
+        self.name = name or type(sink).__name__
+        self.metrics = StageMetrics()
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        for idx in range(self._workers_count):
+            thread = threading.Thread(target=self._work, name='%s-%d' % (self.name, idx))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def receive(self, message, from_, to):
+        if not hasattr(message, 'retain') or not hasattr(message, 'release'):
+            raise Exception('Stage %s needs message with retain and release, got %s' % (self.name,
+                                                                                         type(message).__name__))
+        message.retain()
+        try:
+            if self._put_timeout == 0:
+                self._queue.put_nowait((time.time(), message, from_, to))
+            else:
+                self._queue.put((time.time(), message, from_, to), timeout=self._put_timeout)
+        except Full:
+            message.release()
+            self.metrics.inc('rejected')
+            STAGE_MESSAGES.labels(self.name, 'rejected').inc()
+            raise PipelineFull('Stage %s is full' % self.name)
+        self.metrics.inc('received')
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            queued_at, message, from_, to = item
+            started = time.time()
+            try:
+                self._sink.receive(message, from_, to)
+            except Exception:
+                self.metrics.inc('failed')
+                STAGE_MESSAGES.labels(self.name, 'failed').inc()
+                logger.exception('Stage %s failed to process message', self.name)
+            else:
+                STAGE_MESSAGES.labels(self.name, 'processed').inc()
+            finally:
+                message.release()
+            finished = time.time()
+            self.metrics.record(started - queued_at, finished - started)
+            STAGE_WAIT_SECONDS.labels(self.name).observe(started - queued_at)
+            STAGE_PROCESS_SECONDS.labels(self.name).observe(finished - started)
+
+
+class Pipeline(object):
+    """
+    Chain of sinks, each one behind own QueuedStage. First stage rejects messages when full,
+    inner stages block, so back pressure propagates to the first stage and to SMTP listener.
+    """
+
+    def __init__(self, source, sinks, maxsize=1000, workers=1, put_timeout=0):
+        """
+        :type source: router.router._Source
+        :param sinks: sinks in pipeline order, each one except last is expected to be _Handler
+        :param maxsize: capacity of each stage queue, or list of capacities per stage
+        :param workers: worker threads per stage, or list of counts per stage
+        :param put_timeout: seconds first stage waits for free slot before rejecting message
+        """
+        count = len(sinks)
+        maxsizes = maxsize if hasattr(maxsize, '__iter__') else (maxsize,) * count
+        workers = workers if hasattr(workers, '__iter__') else (workers,) * count
+        self.stages = []
+        upstream = source
+        for idx, sink in enumerate(sinks):
+            stage = QueuedStage(sink, maxsizes[idx], workers[idx], put_timeout if idx == 0 else None)
+            upstream.connect(stage)
+            self.stages.append(stage)
+            if isinstance(sink, _Handler):
+                upstream = sink
+            elif idx + 1 < count:
+                raise Exception('Only handlers could be followed by another stage')
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self):
+        for stage in self.stages:
+            stage.stop()
+
+    def metrics(self):
+        """
+        :return: per stage queue depth and latency metrics
+        :rtype: list<dict>
+        """
+        metrics = []
+        for stage in self.stages:
+            dct = stage.metrics.snapshot()
+            dct['name'] = stage.name
+            dct['depth'] = stage.depth
+            metrics.append(dct)
+        return metrics
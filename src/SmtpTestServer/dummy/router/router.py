@@ -1,58 +1,188 @@
-from email import message_from_string, message_from_file
-from email.message import Message
+import logging
+import threading
+from collections import OrderedDict
 from email.utils import getaddresses
 
 from abc import ABCMeta, abstractmethod
 
+import metrics
+from router.message import ReceivedMessage
+
+
+logger = logging.getLogger(__name__)
+
+ROUTER_RECEIVE_SECONDS = metrics.histogram('router_receive_seconds', 'Routing of received message, including '
+                                           'synchronous routes')
+ROUTER_RECIPIENTS = metrics.counter('router_recipients_total', 'Recipients of routed messages')
+HANDLER_SECONDS = metrics.histogram('handler_prepare_seconds', 'Duration of prepare step of source and handler '
+                                    'stages', ('handler',))
+HANDLER_ERRORS = metrics.counter('handler_errors_total', 'Messages dropped by source and handler stages',
+                                 ('handler',))
+
 
 class RouteSelector(object):
     ___metaclass__ = ABCMeta
 
+    # selectors which choose route by recipient address only, could be cached by router
+    recipient_only = False
+
     @abstractmethod
     def get_route(self, message, to, from_):
         pass
 
+    @property
+    def version(self):
+        return getattr(self, '_version', 0)
+
+    def changed(self):
+        """Notify routers about configuration change, invalidates cached route decisions."""
+        self._version = self.version + 1
+
 
 class Route(object):
     __metaclass__ = ABCMeta
 
     @abstractmethod
     def send(self, message, from_, to):
+        """
+        :param to: batch of recipients resolved to this route
+        :type to: tuple<str>
+        """
         pass
 
 
+class RouteCache(object):
+    """Bounded LRU cache of recipient to route decisions, shared by executor threads of listener."""
+
+    def __init__(self, size=4096):
+        self._size = size
+        self._routes = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, recipient):
+        with self._lock:
+            route = self._routes.get(recipient)
+            if route is None:
+                self.misses += 1
+                return None
+            self._routes.move_to_end(recipient)
+            self.hits += 1
+            return route
+
+    def put(self, recipient, route):
+        with self._lock:
+            self._routes[recipient] = route
+            if len(self._routes) > self._size:
+                self._routes.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+    def __len__(self):
+        return len(self._routes)
+
+
 class Router(object):
 
-    def __init__(self, route_selector):
+    def __init__(self, route_selector, cache_size=4096):
+        """
+        :type route_selector: RouteSelector
+        :param cache_size: size of route decisions cache, used for recipient_only selectors
+        """
         self._route_selector = route_selector
+        self._cache = RouteCache(cache_size)
+        self._cache_version = route_selector.version if hasattr(route_selector, 'version') else 0
+
+    def on_receive(self, message, mail_from=None, rcpt_to=None):
+        """
+        Route received message, routing decision is made from envelope and header block only.
+        :param message: received message
+        :type message: router.message.ReceivedMessage|core.spool.MessageSpool|bytes|str|file|email.message.Message
+        :param mail_from: envelope sender, used when message has no From header
+        :param rcpt_to: envelope recipients, message is routed to them instead of To, Cc and Bcc headers
+        :raise NoRouteException: when message has no recipient or some recipient has no route
+        """
+        with ROUTER_RECEIVE_SECONDS.time():
+            if isinstance(message, ReceivedMessage):
+                msg = message
+            else:
+                msg = ReceivedMessage(message)
+            from_ = getaddresses(msg.get_all('from', []))
+            if not from_ and mail_from:
+                from_ = [('', mail_from)]
+            if rcpt_to:
+                recipients = list(rcpt_to)
+            else:
+                recipients = []
+                for header in ('to', 'cc', 'bcc'):
+                    for name, email in getaddresses(msg.get_all(header, [])):
+                        recipients.append(email)
+            ROUTER_RECIPIENTS.inc(len(recipients))
+            self.route(msg, recipients, from_)
 
-    def on_receive(self, message):
-        msg_type = type(message)
-        if msg_type is str:
-            msg = message_from_string(message)
-        elif msg_type is file:
-            msg = message_from_file(message)
-        elif msg_type is Message:
-            msg = message
-        else:
-            raise Exception('Unsupported message type')
-        from_ = getaddresses(msg.get_all('from'))
-        recipients = []
-        for header in ('to', 'cc', 'bcc'):
-            for name, email in getaddresses(msg.get_all(header)):
-                recipients.append(email)
-        for recipient in recipients:
-            self.route(msg, recipient, from_)
+    def get_route(self, message, to, from_):
+        """
+        :param to: recipient address
+        :rtype: Route
+        """
+        selector = self._route_selector
+        if not getattr(selector, 'recipient_only', False):
+            return selector.get_route(message, to, from_)
+        if selector.version != self._cache_version:
+            self._cache.clear()
+            self._cache_version = selector.version
+        key = to.lower()
+        route = self._cache.get(key)
+        if route is None:
+            route = selector.get_route(message, to, from_)
+            self._cache.put(key, route)
+        return route
 
     def route(self, message, to, from_):
-        route = self._route_selector.get_route(message, to, from_)
-        route.send(message, from_, to)
+        """
+        Group recipients by route, each route is sent message once with its batch of recipients.
+        Delivery is at least once: when later route raises (e.g. router.pipeline.PipelineFull), routes
+        which already accepted message keep it, listener answers with temporary failure and retried
+        message reaches them again.
+        :param to: recipient address or iterable of addresses
+        :raise NoRouteException: when there is no recipient or selector has no route for some of them,
+            message is not sent to any route then
+        """
+        if isinstance(to, str):
+            to = (to,)
+        batches = OrderedDict()
+        unrouted = []
+        for recipient in OrderedDict.fromkeys(to):
+            route = self.get_route(message, recipient, from_)
+            if route is None:
+                unrouted.append(recipient)
+            else:
+                batches.setdefault(route, []).append(recipient)
+        if unrouted:
+            raise NoRouteException('No route for %s' % ', '.join(unrouted))
+        if not batches:
+            raise NoRouteException('Message has no recipients')
+        for route, recipients in batches.items():
+            route.send(message, from_, tuple(recipients))
 
 
 class SourceException(Exception):
     pass
 
 
+class NoRouteException(Exception):
+    """Raised by router for message without routable recipients, listener rejects it permanently."""
+    pass
+
+
+class DeliveryException(Exception):
+    """Raised by sink which failed to accept message, listener answers client with temporary failure."""
+    pass
+
+
 class _Source(object):
     __metaclass__ = ABCMeta
 
@@ -64,15 +194,25 @@ class _Source(object):
             self._sink = sink
 
     def send(self, message, from_, to):
+        name = type(self).__name__
         try:
-            message = self.prepare(message, from_, to)
+            with HANDLER_SECONDS.labels(name).time():
+                message = self.prepare(message, from_, to)
             if self._sink:
                 self._sink.receive(message, from_, to)
         except SourceException as e:
-            print e.message # log zis
+            HANDLER_ERRORS.labels(name).inc()
+            logger.warning('%s dropped message: %s', name, e)
 
     @abstractmethod
     def prepare(self, message, from_, to):
+        """
+        :param message: received message, access message.message only if body is needed,
+            it triggers full MIME parse
+        :type message: router.message.ReceivedMessage
+        :return: message passed to sink, it has to support retain and release (e.g. ReceivedMessage)
+            when sink is pipeline stage
+        """
         pass
 
 
@@ -1,12 +1,31 @@
 """Deffault app settings"""
+import os
+
+from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
-from flask.ext.api import FlaskAPI
+from flask_api import FlaskAPI
 from sqlalchemy.orm import sessionmaker
 
+from api.encoders import JSONRenderer
+
 Base = declarative_base()
 
-# engine = ??
+DATABASE_URL = os.environ.get('SMTP_TEST_SERVER_DB', 'sqlite:///smtp_test_server.db')
+
+engine = create_engine(DATABASE_URL)
+
+# 'database' or 'memory', ephemeral ring buffer for test runs which do not need persistence
+STORAGE = os.environ.get('SMTP_TEST_SERVER_STORAGE', 'database')
+MEMORY_STORAGE_MAX_MESSAGES = int(os.environ.get('SMTP_TEST_SERVER_MEMORY_MESSAGES', 100000))
+MEMORY_STORAGE_MAX_BYTES = int(os.environ.get('SMTP_TEST_SERVER_MEMORY_BYTES', 512 * 1024 * 1024))
+
+# outbound relay of /send/, recipient domain is contacted directly when no relay host is set
+RELAY_HOST = os.environ.get('SMTP_TEST_SERVER_RELAY_HOST') or None
+RELAY_PORT = int(os.environ.get('SMTP_TEST_SERVER_RELAY_PORT', 25))
+RELAY_MAX_PER_HOST = int(os.environ.get('SMTP_TEST_SERVER_RELAY_MAX_PER_HOST', 4))
+RELAY_TIMEOUT = float(os.environ.get('SMTP_TEST_SERVER_RELAY_TIMEOUT', 30))
 
 Session = sessionmaker(bind=engine)
 
 app = FlaskAPI(__name__)
+app.config['DEFAULT_RENDERERS'] = [JSONRenderer, 'flask_api.renderers.BrowsableAPIRenderer']
@@ -21,13 +21,15 @@ def tuplify(elem):
 __EMPTY__ = object()
 
 
-def load_arg(idx, name, default_=None, *args, **kwargs):
-    arg = kwargs.pop(name, __EMPTY__)
-    if len(args) > idx:
+def load_arg(idx_, name_, *args, **kwargs):
+    # default_ is keyword only, so neither positional args nor name kwarg can collide with it
+    default_ = kwargs.pop('default_', None)
+    arg = kwargs.pop(name_, __EMPTY__)
+    if len(args) > idx_:
         if arg is __EMPTY__:
-            arg = args[idx]
+            arg = args[idx_]
         else:
-            raise Exception('Argument %s on index %d defined more than once' % (name, idx))
+            raise Exception('Argument %s on index %d defined more than once' % (name_, idx_))
     if arg is __EMPTY__:
         return default_
     return arg
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'SmtpTestServer', 'dummy'))
+
+# settings read environment on import, tests run against own database file
+os.environ.setdefault('SMTP_TEST_SERVER_DB', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db'))
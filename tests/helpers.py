@@ -0,0 +1,75 @@
+"""Shared fixtures of tests, database of settings is created once per test run."""
+import asyncio
+import threading
+from email.message import EmailMessage
+
+from router.router import Route, RouteSelector, Router
+
+_SCHEMA = []
+
+
+def create_database():
+    """:return: engine of settings with schema at latest version"""
+    import settings
+    from mail_srv.migrations import create_schema
+    if not _SCHEMA:
+        create_schema(settings.engine)
+        _SCHEMA.append(True)
+    return settings.engine
+
+
+def create_message(subject='test message', to='to@example.com', from_='from@example.com', body='Hello'):
+    message = EmailMessage()
+    message['From'] = from_
+    if to is not None:
+        message['To'] = to
+    message['Subject'] = subject
+    message.set_content(body)
+    return message
+
+
+class SinkSelector(Route, RouteSelector):
+    """Routes every recipient to one sink."""
+
+    def __init__(self, sink):
+        self._sink = sink
+
+    def get_route(self, message, to, from_):
+        return self
+
+    def send(self, message, from_, to):
+        self._sink.receive(message, from_, to)
+
+
+def create_router(sink):
+    return Router(SinkSelector(sink))
+
+
+class ServerThread(object):
+    """core.server.DummyServer listening on free port, its event loop runs in background thread."""
+
+    def __init__(self, router):
+        from core.server import DummyServer
+        self.server = DummyServer(router, port=0, hostname='test.local')
+        self.port = None
+        self._loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        listener = self._loop.run_until_complete(self.server.start())
+        self.port = listener.sockets[0].getsockname()[1]
+        self._started.set()
+        self._loop.run_forever()
+
+    def __enter__(self):
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._loop.call_soon_threadsafe(self.server.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
@@ -0,0 +1,46 @@
+import json
+import unittest
+
+from helpers import create_database, create_message
+
+
+def create_attachment_message():
+    message = create_message('with attachment', body='See attached')
+    message.add_attachment(b'attached bytes', maintype='application', subtype='octet-stream',
+                           filename='data.bin')
+    return message
+
+
+class ShowMessagePartsTest(unittest.TestCase):
+
+    def assert_parts(self, client, id_):
+        response = client.get('/inbox/%d' % id_)
+        self.assertEqual(response.status_code, 200)
+        parts = json.loads(response.get_data())['parts']
+        self.assertEqual([(part['part_type'], part['file_name'], part['size']) for part in parts],
+                         [('text/plain', None, len(b'See attached\n')),
+                          ('application/octet-stream', 'data.bin', len(b'attached bytes'))])
+        body = client.get('/inbox/%d/parts/%d' % (id_, parts[1]['id']))
+        self.assertEqual(body.status_code, 200)
+        self.assertEqual(body.get_data(), b'attached bytes')
+
+    def test_database_message_lists_parts(self):
+        from mail_srv import controllers
+        from mail_srv.writer import BatchWriter
+        from router.message import ReceivedMessage
+        stored = []
+        writer = BatchWriter(create_database(), listeners=[stored.extend])
+        writer.receive(ReceivedMessage(create_attachment_message().as_bytes()), [], ['to@example.com'])
+        writer.flush()
+        self.assert_parts(controllers.app.test_client(), stored[0]['id'])
+
+    def test_memory_message_lists_parts(self):
+        from mail_srv import controllers, storage
+        from router.message import ReceivedMessage
+        memory = storage.MemoryStorage(listeners=[])
+        memory.receive(ReceivedMessage(create_attachment_message().as_bytes()), [], ['to@example.com'])
+        previous, storage._STORAGE = storage._STORAGE, memory
+        try:
+            self.assert_parts(controllers.app.test_client(), 1)
+        finally:
+            storage._STORAGE = previous
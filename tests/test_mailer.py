@@ -0,0 +1,21 @@
+import unittest
+
+from core.mailer import Parseable, String, StringList
+
+
+class Mail(Parseable):
+    subject = String()
+    to = StringList()
+
+
+class ParseableTest(unittest.TestCase):
+
+    def test_from_dict_round_trip(self):
+        mail = Mail.from_dict({'subject': 'Hello', 'to': 'to@example.com'})
+        self.assertEqual(dict(mail), {'subject': 'Hello', 'to': 'to@example.com'})
+        self.assertEqual(dict(Mail.from_dict(dict(mail))), dict(mail))
+
+    def test_from_dict_reports_invalid_fields(self):
+        with self.assertRaises(ValueError) as context:
+            Mail.from_dict({'subject': 'Hello', 'unknown': 1})
+        self.assertIn('Invalid field name unknown', str(context.exception))
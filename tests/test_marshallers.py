@@ -0,0 +1,38 @@
+import os
+import unittest
+from datetime import datetime
+
+from api.marshallers import REGISTRY
+from api.models import ApiModel, DateTimeProperty
+
+
+class Event(ApiModel):
+    created = DateTimeProperty('Y/M/d H:m:s')
+
+
+class DateTimePropertyTest(unittest.TestCase):
+
+    def test_load_and_dump_round_trip(self):
+        event = Event.load({'created': '2024/01/02 03:04:05'})
+        self.assertEqual(event.created, datetime(2024, 1, 2, 3, 4, 5))
+        self.assertEqual(Event.dumps(event)['created'], '2024/01/02 03:04:05')
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'fork is not available')
+    def test_forked_child_counts_conversions_in_own_marshaller(self):
+        Event.load({'created': '2024/01/02 03:04:05'})
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            try:
+                Event.load({'created': '2024/01/02 03:04:05'})
+                stats = REGISTRY.stats().get('DateTimeMarshaller:Y/M/d H:m:s', {})
+                os.write(write, b'%d %d' % (stats.get('misses', -1), stats.get('hits', -1)))
+            finally:
+                os._exit(0)
+        os.close(write)
+        with os.fdopen(read, 'rb') as result:
+            reported = result.read()
+        os.waitpid(pid, 0)
+        # child starts with emptied registry, its first conversion is a miss of new memo
+        self.assertEqual(reported, b'1 0')
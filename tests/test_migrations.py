@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine, inspect
+
+from helpers import create_message
+
+
+class MessageFtsMigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///' + os.path.join(tempfile.mkdtemp(), 'migrated.db'))
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_existing_messages_are_searchable_after_migration(self):
+        from mail_srv.migrations import create_schema, current_version, migrate
+        from mail_srv.search import Fts5Index, fts5_supported
+        from mail_srv.writer import BatchWriter
+        from router.message import ReceivedMessage
+        with self.engine.connect() as connection:
+            if not fts5_supported(connection):
+                self.skipTest('SQLite without FTS5')
+        create_schema(self.engine)
+        stored = []
+        writer = BatchWriter(self.engine, search_index=False, listeners=[stored.extend])
+        message = create_message('quarterly invoice', to='Accounting <accounting@example.com>', body='Payment due')
+        writer.receive(ReceivedMessage(message.as_bytes()), [], [])
+        writer.flush()
+        # database of version 3 had no full text table
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql('DROP TABLE %s' % Fts5Index.TABLE)
+            connection.exec_driver_sql('UPDATE schema_version SET version = 3')
+
+        self.assertEqual(migrate(self.engine), [4])
+        with self.engine.connect() as connection:
+            self.assertEqual(current_version(connection), 4)
+            self.assertTrue(inspect(connection).has_table(Fts5Index.TABLE))
+        index = Fts5Index(self.engine)
+        message_id = stored[0]['id']
+        for query in ('invoice', 'payment due', 'accounting'):
+            self.assertEqual(index.search(query), [message_id])
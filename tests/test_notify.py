@@ -0,0 +1,53 @@
+import threading
+import time
+import unittest
+
+from helpers import create_database, create_message, create_router
+
+
+class WaitMessageTest(unittest.TestCase):
+
+    def setUp(self):
+        from mail_srv.writer import BatchWriter
+        self.engine = create_database()
+        self.writer = BatchWriter(self.engine, flush_interval=50)
+        self.writer.start()
+        self.router = create_router(self.writer)
+
+    def tearDown(self):
+        self.writer.stop()
+
+    def test_wait_wakes_up_on_database_ingest(self):
+        from mail_srv import controllers
+        recipient = 'waiter-%d@example.com' % id(self)
+
+        def ingest():
+            time.sleep(0.5)
+            self.router.on_receive(create_message('woken up', to=recipient).as_bytes())
+
+        thread = threading.Thread(target=ingest)
+        thread.start()
+        started = time.time()
+        response = controllers.app.test_client().get('/inbox/wait?recipient=%s&timeout=5' % recipient)
+        elapsed = time.time() - started
+        thread.join()
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, 3)
+        self.assertIn(b'woken up', response.get_data())
+
+
+class MessageNotifierTest(unittest.TestCase):
+
+    def summary(self, id_, recipient='to@example.com'):
+        return {'id': id_, 'sender': 'from@example.com', 'subject': 'message %d' % id_, 'preview': '',
+                'date_created': None, 'recipients': frozenset([recipient])}
+
+    def test_wait_returns_oldest_match_published_after_since(self):
+        from mail_srv.notify import MessageNotifier
+        notifier = MessageNotifier()
+        notifier.publish([self.summary(1), self.summary(2, 'other@example.com')])
+        since = notifier.sequence
+        notifier.publish([self.summary(3), self.summary(4, 'other@example.com'), self.summary(5, 'other@example.com')])
+        self.assertEqual(notifier.wait(since, 0, recipient='other@example.com')['id'], 4)
+        self.assertEqual(notifier.wait(0, 0, recipient='other@example.com')['id'], 2)
+        self.assertIsNone(notifier.wait(notifier.sequence, 0))
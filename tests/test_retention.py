@@ -0,0 +1,60 @@
+import unittest
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from helpers import create_database, create_message
+
+
+class PurgeTest(unittest.TestCase):
+
+    def setUp(self):
+        from mail_srv.writer import BatchWriter
+        self.engine = create_database()
+        self.stored = []
+        self.writer = BatchWriter(self.engine, listeners=[self.stored.extend])
+        self.token = uuid.uuid4().hex
+        self.attachment = self.token.encode('ascii') * 10
+
+    def store(self, count):
+        from router.message import ReceivedMessage
+        for _ in range(count):
+            message = create_message('retention %s' % self.token, body='Body %s' % self.token)
+            message.add_attachment(self.attachment, maintype='application', subtype='octet-stream',
+                                   filename='shared.bin')
+            self.writer.receive(ReceivedMessage(message.as_bytes()), [], ['to@example.com'])
+        self.writer.flush()
+        return [message['id'] for message in self.stored[-count:]]
+
+    def refs(self):
+        from mail_srv.blobs import content_hash
+        from mail_srv.models import Blob
+        blob = Blob.__table__
+        with self.engine.connect() as connection:
+            return connection.execute(select(blob.c.refs).where(blob.c.hash == content_hash(self.attachment)))\
+                .scalar()
+
+    def age(self, message_id, days):
+        from mail_srv.models import Message
+        message = Message.__table__
+        with self.engine.begin() as connection:
+            connection.execute(message.update().where(message.c.id == message_id)
+                               .values(date_created=datetime.utcnow() - timedelta(days=days)))
+
+    def test_purge_releases_blobs_of_deleted_messages(self):
+        from mail_srv.retention import purge
+        from mail_srv.search import get_index
+        old, recent = self.store(2)
+        self.assertEqual(self.refs(), 2)
+        self.age(old, 10)
+        before = datetime.utcnow() - timedelta(days=1)
+        self.assertEqual(purge(self.engine, before)[0], 1)
+        self.assertEqual(self.refs(), 1)
+        self.assertEqual(get_index(self.engine).search(self.token), [recent])
+
+        self.age(recent, 10)
+        deleted, removed = purge(self.engine, before)
+        self.assertEqual((deleted, removed), (1, 2))
+        self.assertIsNone(self.refs())
+        self.assertEqual(get_index(self.engine).search(self.token), [])
@@ -0,0 +1,91 @@
+import smtplib
+import unittest
+
+from helpers import ServerThread, create_message
+from router.router import Route, RouteSelector, Router
+
+
+class RecordingRoute(Route):
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message, from_, to):
+        self.sent.append((message.get('subject'), from_, to))
+
+
+class EnvelopeSelector(RouteSelector):
+    """Routes only recipients of known domain."""
+
+    def __init__(self, route, domain='example.com'):
+        self._route = route
+        self._domain = domain
+
+    def get_route(self, message, to, from_):
+        return self._route if to.endswith('@' + self._domain) else None
+
+
+class DeliverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.route = RecordingRoute()
+        self.router = Router(EnvelopeSelector(self.route))
+
+    def send(self, message, from_addr, to_addrs):
+        with ServerThread(self.router) as thread:
+            client = smtplib.SMTP('127.0.0.1', thread.port)
+            try:
+                return client.sendmail(from_addr, to_addrs, message.as_bytes())
+            finally:
+                client.quit()
+
+    def test_envelope_recipient_without_header_is_routed(self):
+        message = create_message('blind copy', to=None)
+        del message['From']
+        self.send(message, 'sender@example.com', ['hidden@example.com'])
+        self.assertEqual(self.route.sent, [('blind copy', [('', 'sender@example.com')], ('hidden@example.com',))])
+
+    def test_envelope_recipients_replace_header_recipients(self):
+        message = create_message('bcc', to='visible@example.com')
+        self.send(message, 'sender@example.com', ['visible@example.com', 'bcc@example.com'])
+        self.assertEqual([sent[2] for sent in self.route.sent], [('visible@example.com', 'bcc@example.com')])
+
+    def test_unroutable_recipient_is_rejected(self):
+        message = create_message('unroutable', to='someone@elsewhere.org')
+        with self.assertRaises(smtplib.SMTPDataError) as context:
+            self.send(message, 'sender@example.com', ['someone@elsewhere.org', 'known@example.com'])
+        self.assertEqual(context.exception.smtp_code, 550)
+        self.assertEqual(self.route.sent, [])
+
+
+class PipeliningTest(unittest.TestCase):
+
+    def setUp(self):
+        self.route = RecordingRoute()
+        self.router = Router(EnvelopeSelector(self.route))
+
+    def exchange(self, payload, replies):
+        import socket
+        with ServerThread(self.router) as thread:
+            connection = socket.create_connection(('127.0.0.1', thread.port), timeout=5)
+            try:
+                received = b''
+                connection.sendall(payload)
+                while received.count(b'\r\n') < replies:
+                    data = connection.recv(65536)
+                    if not data:
+                        break
+                    received += data
+            finally:
+                connection.close()
+        return [line.split(b' ', 1)[0] for line in received.split(b'\r\n') if line]
+
+    def test_pipelined_transaction_is_answered_in_order(self):
+        message = create_message('pipelined', to='to@example.com').as_bytes().replace(b'\n', b'\r\n')
+        payload = (b'EHLO client\r\nMAIL FROM:<from@example.com>\r\nRCPT TO:<to@example.com>\r\n'
+                   b'BDAT %d LAST\r\n' % len(message) + message +
+                   b'MAIL FROM:<from@example.com>\r\nRCPT TO:<to@example.com>\r\nDATA\r\n')
+        codes = self.exchange(payload + message + b'.\r\nQUIT\r\n', 13)
+        self.assertEqual([code for code in codes if not code.startswith(b'250-')],
+                         [b'220', b'250', b'250', b'250', b'250', b'250', b'250', b'354', b'250', b'221'])
+        self.assertEqual([sent[0] for sent in self.route.sent], ['pipelined', 'pipelined'])
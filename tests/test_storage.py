@@ -0,0 +1,41 @@
+import threading
+import unittest
+
+from helpers import create_message
+
+
+def receive(storage, token):
+    from router.message import ReceivedMessage
+    storage.receive(ReceivedMessage(create_message('memory %s' % token).as_bytes()), [], ['to@example.com'])
+
+
+class MemoryStorageSearchTest(unittest.TestCase):
+
+    def test_visible_message_is_searchable(self):
+        from mail_srv.storage import MemoryStorage
+        storage = MemoryStorage(listeners=[])
+        count, missing = 300, []
+
+        def ingest():
+            for number in range(count):
+                receive(storage, 'token%d' % number)
+
+        thread = threading.Thread(target=ingest)
+        thread.start()
+        while thread.is_alive():
+            for record in storage.list_messages(1):
+                token = record.subject.split()[-1]
+                if record not in storage.search(token, 1):
+                    missing.append(token)
+        thread.join()
+        self.assertEqual(len(storage), count)
+        self.assertEqual(missing, [])
+
+    def test_evicted_message_is_not_searchable(self):
+        from mail_srv.storage import MemoryStorage
+        storage = MemoryStorage(max_messages=2, listeners=[])
+        for token in ('first', 'second', 'third'):
+            receive(storage, token)
+        self.assertEqual(storage.search('first', 10), [])
+        self.assertEqual(sorted(record.subject for record in storage.search('memory', 10)),
+                         ['memory second', 'memory third'])
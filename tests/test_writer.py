@@ -0,0 +1,38 @@
+import unittest
+
+from helpers import create_database, create_message, create_router
+
+
+class DurableWriterTest(unittest.TestCase):
+
+    def test_failing_listener_does_not_fail_stored_message(self):
+        from mail_srv.writer import BatchWriter
+        stored = []
+
+        def failing(messages):
+            raise RuntimeError('listener failed')
+
+        writer = BatchWriter(create_database(), flush_interval=10, durable=True, durable_timeout=5,
+                             listeners=[failing, stored.extend])
+        writer.start()
+        try:
+            create_router(writer).on_receive(create_message('durable').as_bytes())
+        finally:
+            writer.stop()
+        self.assertEqual([message['subject'] for message in stored], ['durable'])
+        self.assertEqual(writer.flushed_messages, 1)
+
+    def test_durable_receive_fails_when_transaction_fails(self):
+        from mail_srv.writer import BatchWriter
+        from router.router import DeliveryException
+        writer = BatchWriter(create_database(), flush_interval=10, durable=True, durable_timeout=5, listeners=[])
+
+        def fail(batch):
+            raise RuntimeError('database is gone')
+        writer._write = fail
+        writer.start()
+        try:
+            with self.assertRaises(DeliveryException):
+                create_router(writer).on_receive(create_message('lost').as_bytes())
+        finally:
+            writer.stop()